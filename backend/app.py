@@ -1,21 +1,46 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import sqlite3
 import os
+import io
+import csv
 import uuid
 import re
 import json
+import random
 from datetime import datetime, date, timedelta
-from gtts import gTTS
 import tempfile
 import subprocess
 import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import speech_recognition as sr
+from db import get_db, pool as db_pool
+from migrations import migrate, check_schema_version
+from cache import ResponseDataCache
+from conversation_log import ConversationLogger
+from conversation_history import (ConversationArchiver, fetch_history_page,
+                                  HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE)
+from ingestion import MeterReadingIngestor, iter_csv, iter_ndjson
+from rollups import RollupEngine, DEFAULT_COMMUNITY_ID
+from dates import local_today, previous_day, parse_date_range
+from tariffs import TariffEngine
+from templates import CompiledTemplate, render_cache
+from metrics import registry, span, db_span, count_intent, RequestTimer
+from tts import TTSService, TTSJob
+from storage import AudioStorage
+from audio_decode import decode_audio, AudioDecodeError, TARGET_SAMPLE_RATE, TARGET_SAMPLE_WIDTH
+from speech import RecognizerPool, SpeechNotUnderstood, SpeechServiceError
+from streaming import SpeechSegmenter, PCMStreamConverter, read_wav_header
 
 app = Flask(__name__)
 CORS(app)
 
-# Function to get local IP address
+# Function to get local IP address (resolved once, on first use)
+@lru_cache(maxsize=1)
 def get_local_ip():
     try:
         # Create a socket to get the local IP
@@ -38,60 +63,6 @@ def get_base_url(port=5000):
         # For local development
         return f"http://{get_local_ip()}:{port}"
 
-# Initialize BASE_URL
-BASE_URL = get_base_url(5000)
-
-# Database setup
-def init_db():
-    conn = sqlite3.connect('eco_whisper_demo.db')
-    cursor = conn.cursor()
-    
-    # Check if conversations table exists and has the old structure
-    cursor.execute("PRAGMA table_info(conversations)")
-    columns = [column[1] for column in cursor.fetchall()]
-    
-    # If conversations table exists but doesn't have user_id column, add it
-    if len(columns) > 0 and 'user_id' not in columns:
-        print("Upgrading conversations table...")
-        try:
-            cursor.execute('ALTER TABLE conversations ADD COLUMN user_id TEXT')
-            cursor.execute('ALTER TABLE conversations ADD COLUMN intent_matched TEXT')
-        except sqlite3.OperationalError:
-            pass  # Columns might already exist
-    
-    # Check if Intent table exists and add question_patterns column if needed
-    cursor.execute("PRAGMA table_info(Intent)")
-    intent_columns = [column[1] for column in cursor.fetchall()]
-    
-    if len(intent_columns) > 0 and 'question_patterns' not in intent_columns:
-        print("Upgrading Intent table...")
-        try:
-            cursor.execute('ALTER TABLE Intent ADD COLUMN question_patterns TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column might already exist
-    
-    # Create new tables if they don't exist
-    try:
-        # Read and execute schema
-        with open('schema.sql', 'r') as f:
-            schema = f.read()
-            cursor.executescript(schema)
-    except sqlite3.OperationalError as e:
-        print(f"Schema execution error (some tables may already exist): {e}")
-    
-    # Read and execute sample data
-    try:
-        with open('sample_data.sql', 'r') as f:
-            sample_data = f.read()
-            cursor.executescript(sample_data)
-    except sqlite3.OperationalError as e:
-        print(f"Sample data execution error (some data may already exist): {e}")
-    
-    conn.commit()
-    conn.close()
-
-init_db()
-
 @app.route('/')
 def health_check():
     """Health check endpoint for Railway"""
@@ -106,349 +77,791 @@ def health():
     """Alternative health check endpoint"""
     return jsonify({'status': 'ok'})
 
-def match_intent(user_input):
-    """Match user input to database intents using pattern matching"""
-    user_input_lower = user_input.lower()
-    
-    conn = sqlite3.connect('eco_whisper_demo.db')
-    cursor = conn.cursor()
-    
-    # Get all intents with their question patterns
-    cursor.execute('SELECT intent_id, name, question_patterns FROM Intent')
-    intents = cursor.fetchall()
-    
-    best_match = None
-    best_score = 0
-    
-    for intent_id, intent_name, patterns_json in intents:
-        if patterns_json:
+# Read-through caches for the data lookups in get_response
+response_cache = ResponseDataCache()
+tariff_engine = TariffEngine()
+
+# How often (seconds) match_intent checks Intent_Version for table changes
+INTENT_INDEX_CHECK_INTERVAL = float(os.environ.get('INTENT_INDEX_CHECK_INTERVAL', '5'))
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton that finds every keyword occurring in a text in one pass"""
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        
+        # Build the keyword trie
+        for keyword_id, keyword in enumerate(self.keywords):
+            node = 0
+            for char in keyword:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = next_node
+            self._out[node] += (keyword_id,)
+        
+        # Wire failure links breadth-first and merge outputs along them,
+        # so each node reports every keyword ending at that position
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] += self._out[self._fail[child]]
+
+    def find(self, text):
+        """Return the set of keyword ids that occur anywhere in text"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+def compile_template(intent_id, template):
+    """CompiledTemplate for an Intent row; unparsable text (e.g. a stray brace) is kept as-is"""
+    try:
+        return CompiledTemplate(template)
+    except ValueError as e:
+        print(f"Error parsing response template of intent {intent_id} ({e}), answering with it verbatim")
+        return CompiledTemplate(template, verbatim=True)
+
+class IntentIndex:
+    """In-memory index of Intent question patterns and compiled templates, rebuilt only when the table changes"""
+
+    def __init__(self, check_interval=INTENT_INDEX_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        # (automaton, entries) swapped as one tuple so readers never see a half-built index
+        self._compiled = (KeywordAutomaton([]), [])
+        # intent_id -> (name, CompiledTemplate, requires_data_access)
+        self._intents = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def build(self, rows):
+        """Compile (intent_id, name, question_patterns) rows into the automaton"""
+        # Keep the best (score, order) entry per pattern text. Order preserves the
+        # old scan's tie-break: the first intent/pattern seen with the top score wins.
+        best = {}
+        order = 0
+        for intent_id, intent_name, patterns_json in rows:
+            if not patterns_json:
+                continue
             try:
                 patterns = json.loads(patterns_json)
+                candidates = []
                 for pattern in patterns:
                     pattern_lower = pattern.lower()
-                    # Improved matching logic
-                    if pattern_lower in user_input_lower:
-                        score = len(pattern_lower.split())  # Longer patterns get higher scores
-                        if score > best_score:
-                            best_score = score
-                            best_match = intent_id
+                    candidates.append((pattern_lower, len(pattern_lower.split())))  # Longer patterns get higher scores
             except json.JSONDecodeError:
-                # Fallback to simple keyword matching
-                if intent_name.lower() in user_input_lower:
-                    if len(intent_name) > best_score:
-                        best_score = len(intent_name)
-                        best_match = intent_id
-    
-    conn.close()
+                # Fallback to simple keyword matching on the intent name
+                candidates = [(intent_name.lower(), len(intent_name))]
+            
+            for pattern_lower, score in candidates:
+                order += 1
+                if score <= 0:
+                    continue  # Can never beat "no match"
+                current = best.get(pattern_lower)
+                if current is None or score > current[0]:
+                    best[pattern_lower] = (score, -order, intent_id)
+        
+        keywords = list(best)
+        self._compiled = (KeywordAutomaton(keywords), [best[k] for k in keywords])
+
+    def load(self, conn=None):
+        """(Re)build the index from the Intent table"""
+        if conn is None:
+            with get_db() as conn:
+                return self.load(conn)
+        cursor = conn.cursor()
+        version = self._read_version(cursor)
+        cursor.execute('SELECT intent_id, name, question_patterns, response_template, requires_data_access FROM Intent')
+        rows = cursor.fetchall()
+        self.build([row[:3] for row in rows])
+        # Templates are parsed here, once per table version, not on every answer
+        self._intents = {
+            intent_id: (name, compile_template(intent_id, template or ''), requires_data_access)
+            for intent_id, name, _, template, requires_data_access in rows
+        }
+        if version != self._version:
+            # Renders of the old templates can no longer be hit; free them
+            render_cache.invalidate()
+        self._version = version
+        self._checked_at = time.monotonic()
+
+    def refresh(self, force=False):
+        """Rebuild the index if Intent_Version moved since the last load"""
+        if not force and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return  # Another thread is already checking; keep serving the current index
+        try:
+            with get_db() as conn:
+                version = self._read_version(conn.cursor())
+                if force or version is None or version != self._version:
+                    self.load(conn)
+                else:
+                    self._checked_at = time.monotonic()
+        except sqlite3.Error as e:
+            print(f"Error refreshing intent index: {e}")
+            self._checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def intent(self, intent_id):
+        """(name, CompiledTemplate, requires_data_access) for an intent, or None"""
+        self.refresh()
+        return self._intents.get(intent_id)
+
+    def invalidate(self):
+        """Force a rebuild on the next match (use after writing to Intent in-process)"""
+        self._checked_at = 0.0
+        self._version = None
+
+    def match(self, user_input):
+        """Return the intent_id of the highest-scoring pattern found in user_input, or None"""
+        return self.match_many([user_input])[0]
+
+    def match_many(self, user_inputs):
+        """match() for a list of inputs against one snapshot of the index"""
+        self.refresh()
+        automaton, entries = self._compiled
+        matches = []
+        for user_input in user_inputs:
+            best = None
+            for keyword_id in automaton.find(user_input.lower()):
+                entry = entries[keyword_id]
+                if best is None or entry > best:
+                    best = entry
+            matches.append(best[2] if best else None)
+        return matches
+
+    @staticmethod
+    def _read_version(cursor):
+        try:
+            cursor.execute('SELECT version FROM Intent_Version WHERE id = 1')
+            row = cursor.fetchone()
+            return row[0] if row else None
+        except sqlite3.OperationalError:
+            return None  # Older database without the version table
+
+intent_index = IntentIndex()
+
+def match_intent(user_input):
+    """Match user input to database intents using the compiled pattern index"""
+    best_match = intent_index.match(user_input)
     
     # If no database match found, try enhanced legacy matching
     if not best_match:
-        return match_intent_enhanced(user_input)
+        return match_intent_fallback(user_input)
     
+    count_intent(best_match, 'index')
     return best_match
 
+def match_intents(user_inputs):
+    """match_intent for many inputs, checking the index for changes once"""
+    intents = []
+    for user_input, best_match in zip(user_inputs, intent_index.match_many(user_inputs)):
+        if best_match:
+            count_intent(best_match, 'index')
+            intents.append(best_match)
+        else:
+            intents.append(match_intent_fallback(user_input))
+    return intents
+
+def match_intent_fallback(user_input):
+    """Keyword-rule match for input no Intent pattern covers, counted by outcome"""
+    intent = match_intent_enhanced(user_input)
+    count_intent(intent, 'default' if intent == 'general_eco' else 'rules')
+    return intent
+
+# Keyword fallback rules used when no Intent pattern matches
+INTENT_RULES_PATH = os.environ.get('INTENT_RULES_PATH',
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_rules.json'))
+
+class IntentRuleSet:
+    """Ordered keyword/qualifier rules compiled into a single keyword automaton
+
+    A rule fires when any of its keywords occurs in the input and, if it has
+    qualifiers, any qualifier occurs too. The first firing rule (in file order)
+    wins, so the table reads like the if/elif cascade it replaces.
+    """
+
+    def __init__(self, rules, default_intent='general_eco', keyword_sets=None):
+        keyword_sets = keyword_sets or {}
+        self.default_intent = default_intent
+        
+        phrase_ids = {}
+        def resolve(phrases):
+            # A rule may name a shared keyword set instead of listing phrases inline
+            if isinstance(phrases, str):
+                phrases = keyword_sets[phrases]
+            return frozenset(phrase_ids.setdefault(phrase.lower(), len(phrase_ids)) for phrase in phrases)
+        
+        self._rules = []
+        self._rules_by_keyword = {}
+        for rule in rules:
+            keywords = resolve(rule['keywords'])
+            qualifiers = resolve(rule['qualifiers']) if rule.get('qualifiers') else None
+            rule_index = len(self._rules)
+            self._rules.append((keywords, qualifiers, rule['intent']))
+            for keyword_id in keywords:
+                self._rules_by_keyword.setdefault(keyword_id, []).append(rule_index)
+        
+        self._automaton = KeywordAutomaton(sorted(phrase_ids, key=phrase_ids.get))
+
+    def match(self, user_input):
+        """Return the intent of the first rule whose keywords (and qualifiers) occur in user_input"""
+        found = self._automaton.find(user_input.lower())
+        
+        # Only rules with a keyword present in the input are evaluated
+        candidates = set()
+        for phrase_id in found:
+            candidates.update(self._rules_by_keyword.get(phrase_id, ()))
+        
+        for rule_index in sorted(candidates):
+            keywords, qualifiers, intent = self._rules[rule_index]
+            if qualifiers is None or not qualifiers.isdisjoint(found):
+                return intent
+        
+        return self.default_intent
+
+def load_intent_rules(path=INTENT_RULES_PATH):
+    """Load and compile the rule sets from the JSON rule table"""
+    try:
+        with open(path, 'r') as f:
+            config = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error loading intent rules from {path}: {e}")
+        return {}
+    
+    keyword_sets = config.get('keyword_sets', {})
+    return {
+        name: IntentRuleSet(rule_set['rules'], rule_set.get('default', 'general_eco'), keyword_sets)
+        for name, rule_set in config.get('rule_sets', {}).items()
+    }
+
+intent_rules = load_intent_rules()
+
 def match_intent_enhanced(user_input):
     """Enhanced intent matching for better accuracy"""
-    user_input_lower = user_input.lower()
-    
-    # Community usage patterns - more specific matching
-    if any(phrase in user_input_lower for phrase in ['community use', 'community usage', 'neighborhood use', 'neighborhood usage', 'how much did my community use']):
-        if any(word in user_input_lower for word in ['today', 'did', 'how much']):
-            return "intent2"  # query_community_usage
-    
-    # Sustainability tip patterns - more specific matching
-    if any(phrase in user_input_lower for phrase in ['green tips', 'eco tips', 'sustainability tips', 'sustainable tips', 'any green tips', 'any eco tips', 'any green tips for today']):
-        return "intent6"  # random_tip
-    
-    # Community comparison patterns - more specific matching
-    if any(phrase in user_input_lower for phrase in ['green compared', 'greener than', 'compared to others', 'community comparison', 'how green am i', 'how green am i compared to others']):
-        return "intent9"  # compare_community
-    
-    # Specific patterns for the problematic questions
-    if any(phrase in user_input_lower for phrase in ['greenest time', 'best time to use power', 'greenest time to use power', "what's the greenest time to use power"]):
-        return "intent4"  # greenest_time
-    
-    if any(phrase in user_input_lower for phrase in ['carbon dioxide', 'co2', 'co₂', 'carbon']):
-        if any(word in user_input_lower for word in ['save', 'saved', 'reduced']):
-            return "intent5"  # query_co2_saved
-    
-    if any(phrase in user_input_lower for phrase in ['summarize', 'summary', 'green behavior', 'eco behavior']):
-        if any(word in user_input_lower for word in ['today', 'daily']):
-            return "intent10"  # summary_today
-    
-    # Electricity usage patterns
-    if any(word in user_input_lower for word in ['electricity', 'power', 'energy', 'kwh', 'kilowatt']):
-        if any(word in user_input_lower for word in ['today', 'used', 'consumption', 'usage']):
-            return "intent1"  # query_electricity_today
-        elif any(word in user_input_lower for word in ['save', 'reduce', 'lower', 'cut']):
-            return "electricity_save"
-        elif any(word in user_input_lower for word in ['cost', 'bill', 'money', 'dollars', 'euros']):
-            return "electricity_cost"
-    
-    # Appliance-specific patterns
-    if any(word in user_input_lower for word in ['dishwasher', 'dish washer']):
-        if any(word in user_input_lower for word in ['time', 'when', 'best']):
-            return "dishwasher_time"
-        elif any(word in user_input_lower for word in ['save', 'efficient', 'eco']):
-            return "dishwasher_save"
-    
-    if any(word in user_input_lower for word in ['laundry', 'washer', 'washing machine']):
-        if any(word in user_input_lower for word in ['time', 'when', 'best', 'greenest']):
-            return "laundry_time"
-        elif any(word in user_input_lower for word in ['save', 'efficient', 'eco']):
-            return "laundry_save"
-    
-    # Food and diet patterns
-    if any(word in user_input_lower for word in ['milk', 'oat', 'almond', 'dairy']):
-        if any(word in user_input_lower for word in ['eco', 'friendly', 'sustainable', 'better']):
-            return "milk_comparison"
-    
-    # General sustainability
-    if any(word in user_input_lower for word in ['tip', 'advice', 'sustainable', 'eco']):
-        if any(word in user_input_lower for word in ['today', 'daily', 'everyday']):
-            return "intent6"  # random_tip
-    
-    return "general_eco"
+    rule_set = intent_rules.get('enhanced')
+    return rule_set.match(user_input) if rule_set else "general_eco"
 
 def match_intent_legacy(user_input):
     """Legacy intent matching for backward compatibility"""
-    user_input_lower = user_input.lower()
-    
-    # Electricity usage patterns
-    if any(word in user_input_lower for word in ['electricity', 'power', 'energy', 'kwh', 'kilowatt']):
-        if any(word in user_input_lower for word in ['today', 'used', 'consumption', 'usage']):
-            return "electricity_today"
-        elif any(word in user_input_lower for word in ['save', 'reduce', 'lower', 'cut']):
-            return "electricity_save"
-        elif any(word in user_input_lower for word in ['cost', 'bill', 'money', 'dollars']):
-            return "electricity_cost"
-    
-    # Appliance-specific patterns
-    if any(word in user_input_lower for word in ['dishwasher', 'dish washer']):
-        if any(word in user_input_lower for word in ['time', 'when', 'best']):
-            return "dishwasher_time"
-        elif any(word in user_input_lower for word in ['save', 'efficient', 'eco']):
-            return "dishwasher_save"
-    
-    if any(word in user_input_lower for word in ['laundry', 'washer', 'washing machine']):
-        if any(word in user_input_lower for word in ['time', 'when', 'best', 'greenest']):
-            return "laundry_time"
-        elif any(word in user_input_lower for word in ['save', 'efficient', 'eco']):
-            return "laundry_save"
-    
-    # Food and diet patterns
-    if any(word in user_input_lower for word in ['milk', 'oat', 'almond', 'dairy']):
-        if any(word in user_input_lower for word in ['eco', 'friendly', 'sustainable', 'better']):
-            return "milk_comparison"
-    
-    # General sustainability
-    if any(word in user_input_lower for word in ['tip', 'advice', 'sustainable', 'eco']):
-        if any(word in user_input_lower for word in ['today', 'daily', 'everyday']):
-            return "daily_tip"
-    
-    return "general_eco"
-
-def get_response(intent_id, user_id=None):
-    """Get dynamic response based on intent and database data"""
-    conn = sqlite3.connect('eco_whisper_demo.db')
-    cursor = conn.cursor()
+    rule_set = intent_rules.get('legacy')
+    return rule_set.match(user_input) if rule_set else "general_eco"
+
+def query_one(sql, params=()):
+    with get_db() as conn:
+        return conn.execute(sql, params).fetchone()
+
+def fetch_intent(intent_id):
+    """(name, CompiledTemplate, requires_data_access) for an intent, or None"""
+    return intent_index.intent(intent_id)
+
+def fetch_community_stats(day):
+    """(avg_kwh_per_user, total_co2_saved) for a date, shared by every user"""
+    def load():
+        with db_span('community_stats'):
+            return query_one('''
+                SELECT avg_kwh_per_user, total_co2_saved FROM Community_Stats 
+                WHERE date = ? ORDER BY created_at DESC LIMIT 1
+            ''', (day,))
+    return response_cache.get('community', day, load)
+
+def load_user_day(user_id, day, include_community=False):
+    """Fetch a user's usage, impact and weekly cost for a date in one query
+
+    With include_community the day's Community_Stats row rides along in the same
+    round trip. Returns (bundle, community_row).
+    """
+    yesterday = previous_day(day)
+    sql = '''
+        SELECT 'usage', date, kwh_used, estimated_cost, is_peak_time FROM Electricity_Usage 
+        WHERE user_id = ? AND date IN (?, ?)
+        UNION ALL
+        SELECT 'impact', impact_type, impact_value, NULL, NULL FROM Impact_Record 
+        WHERE user_id = ? AND date = ? AND impact_type IN ('CO2_saved', 'water_saved')
+        UNION ALL
+        SELECT 'week_cost', NULL, SUM(estimated_cost), SUM(kwh_used), NULL FROM Electricity_Usage 
+        WHERE user_id = ? AND date >= date(?, '-7 days') AND date <= ?
+    '''
+    params = [user_id, day, yesterday, user_id, day, user_id, day, day]
+    if include_community:
+        sql += '''
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'community', date, avg_kwh_per_user, total_co2_saved, NULL FROM Community_Stats 
+            WHERE date = ? ORDER BY created_at DESC LIMIT 1
+        )
+        '''
+        params.append(day)
     
+    bundle = {'usage': {}, 'impact': {}, 'week_cost': None, 'week_kwh': None}
+    community = None
+    with db_span('user_day_with_community' if include_community else 'user_day'), get_db() as conn:
+        for kind, label, value, extra, peak in conn.execute(sql, params):
+            if kind == 'usage':
+                bundle['usage'][label] = (value, extra, peak)
+            elif kind == 'impact':
+                bundle['impact'][label] = value
+            elif kind == 'week_cost':
+                bundle['week_cost'] = value
+                bundle['week_kwh'] = extra
+            elif kind == 'community':
+                community = (value, extra)
+    return bundle, community
+
+def load_user_days(user_days):
+    """load_user_day for many (user_id, day) pairs with one grouped query per table
+
+    Returns {(user_id, day): bundle}; pairs without any rows get an empty bundle.
+    """
+    user_days = set(user_days)
+    bundles = {pair: {'usage': {}, 'impact': {}, 'week_cost': None, 'week_kwh': None} for pair in user_days}
+    if not user_days:
+        return bundles
+    days = sorted({day for _, day in user_days})
+    # The week window reaches 7 days back, like load_user_day
+    first_day = (date.fromisoformat(days[0]) - timedelta(days=7)).isoformat()
+    wanted_days = {}
+    for user_id, day in user_days:
+        wanted_days.setdefault(user_id, []).append(day)
+    
+    user_ids = sorted(wanted_days)
+    with db_span('user_days_batch'), get_db() as conn:
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            usage_rows = conn.execute(f'''
+                SELECT user_id, date, kwh_used, estimated_cost, is_peak_time FROM Electricity_Usage
+                WHERE user_id IN ({placeholders}) AND date BETWEEN ? AND ?
+            ''', chunk + [first_day, days[-1]]).fetchall()
+            impact_rows = conn.execute(f'''
+                SELECT user_id, date, impact_type, impact_value FROM Impact_Record
+                WHERE user_id IN ({placeholders}) AND date IN ({','.join('?' * len(days))})
+                  AND impact_type IN ('CO2_saved', 'water_saved')
+            ''', chunk + days).fetchall()
+            
+            for user_id, usage_date, kwh, cost, peak in usage_rows:
+                for day in wanted_days[user_id]:
+                    bundle = bundles[(user_id, day)]
+                    if usage_date in (day, previous_day(day)):
+                        bundle['usage'][usage_date] = (kwh, cost, peak)
+                    if (date.fromisoformat(day) - date.fromisoformat(usage_date)).days in range(8):
+                        if cost is not None:
+                            bundle['week_cost'] = (bundle['week_cost'] or 0) + cost
+                        if kwh is not None:
+                            bundle['week_kwh'] = (bundle['week_kwh'] or 0) + kwh
+            for user_id, impact_date, impact_type, value in impact_rows:
+                if (user_id, impact_date) in bundles:
+                    bundles[(user_id, impact_date)]['impact'][impact_type] = value
+    return bundles
+
+def load_community_days(days):
+    """{day: (avg_kwh_per_user, total_co2_saved)} for many dates in one query"""
+    days = sorted(set(days))
+    if not days:
+        return {}
+    community = {}
+    with db_span('community_stats_batch'), get_db() as conn:
+        rows = conn.execute(f'''
+            SELECT date, avg_kwh_per_user, total_co2_saved FROM Community_Stats
+            WHERE date IN ({','.join('?' * len(days))}) ORDER BY created_at DESC
+        ''', days)
+        for day, avg_kwh, co2 in rows:
+            community.setdefault(day, (avg_kwh, co2))
+    return community
+
+def fetch_user_day(user_id, day):
+    """Cached per-user bundle for a date (see load_user_day)"""
+    return response_cache.get('user', (user_id, day), lambda: load_user_day(user_id, day)[0])
+
+def fetch_usage(user_id, day):
+    """(kwh_used, estimated_cost, is_peak_time) for a user and date"""
+    return fetch_user_day(user_id, day)['usage'].get(day)
+
+# SQL grouping expression per range granularity; weeks start on Monday
+RANGE_PERIODS = {
+    'day': 'date',
+    'week': "date(date, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m-01', date)",
+}
+
+def load_usage_range(user_id, start, end, granularity='day'):
+    """A user's usage between two dates (inclusive) as a list of per-period totals"""
+    period = RANGE_PERIODS[granularity]
+    # Answered entirely from idx_electricity_usage_user_date_covering
+    sql = f'''
+        SELECT {period} AS period, SUM(kwh_used), SUM(estimated_cost), MAX(is_peak_time), COUNT(*)
+        FROM Electricity_Usage
+        WHERE user_id = ? AND date BETWEEN ? AND ?
+        GROUP BY period ORDER BY period
+    '''
+    with get_db() as conn:
+        return [{
+            'date': period_start,
+            'kwh_used': round(kwh or 0, 2),
+            'estimated_cost': round(cost, 2) if cost is not None else None,
+            'is_peak_time': bool(peak),
+            'days': days,
+        } for period_start, kwh, cost, peak, days in conn.execute(sql, (user_id, start, end))]
+
+def load_community_range(community_id, start, end, granularity='day'):
+    """A community's daily stats between two dates (inclusive), grouped per period"""
+    period = RANGE_PERIODS[granularity]
+    # Answered entirely from idx_community_stats_range
+    sql = f'''
+        SELECT {period} AS period, AVG(avg_kwh_per_user), SUM(total_co2_saved), COUNT(*)
+        FROM Community_Stats
+        WHERE community_id = ? AND date BETWEEN ? AND ?
+        GROUP BY period ORDER BY period
+    '''
+    with get_db() as conn:
+        return [{
+            'date': period_start,
+            'avg_kwh_per_user': round(avg_kwh, 2) if avg_kwh is not None else None,
+            'total_co2_saved': round(co2, 2) if co2 is not None else None,
+            'days': days,
+        } for period_start, avg_kwh, co2, days in conn.execute(sql, (community_id, start, end))]
+
+def fetch_user_timezone(user_id):
+    """The user's IANA time zone name, or None to use the default"""
+    def load():
+        with db_span('user_timezone'):
+            row = query_one('SELECT timezone FROM users WHERE user_id = ?', (user_id,))
+        return row[0] if row else None
+    return response_cache.get('user', (user_id, 'timezone'), load)
+
+def fetch_user_timezones(user_ids):
+    """{user_id: timezone name or None} for many users in grouped queries"""
+    user_ids = sorted(set(user_ids))
+    timezones = dict.fromkeys(user_ids)
+    with db_span('user_timezones_batch'), get_db() as conn:
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            timezones.update(conn.execute(
+                f'SELECT user_id, timezone FROM users WHERE user_id IN ({placeholders})', chunk).fetchall())
+    return timezones
+
+def user_today(user_id=None):
+    """Today's date for a user, in their own time zone"""
+    return local_today(fetch_user_timezone(user_id) if user_id else None)
+
+def fetch_active_tips():
+    """Content of every active tip"""
+    def load():
+        with db_span('active_tips'), get_db() as conn:
+            return [row[0] for row in conn.execute('SELECT content FROM Tip WHERE is_active = 1')]
+    return response_cache.get('tips', 'active', load)
+
+def prefetch_response_data(needs, user_id, day):
+    """Resolve everything a handler declared it needs, in at most one query"""
+    data = {}
+    user_cache = response_cache.sources['user']
+    community_cache = response_cache.sources['community']
+    want_user = 'user' in needs and user_id
+    want_community = 'community' in needs
+    
+    if want_user:
+        # The community row joins the user's query when it isn't cached yet
+        def load():
+            bundle, community = load_user_day(user_id, day, include_community=want_community)
+            if want_community:
+                data['community'] = community_cache.get_or_load(day, lambda: community)
+            return bundle
+        data['user'] = user_cache.get_or_load((user_id, day), load)
+    
+    if want_community and 'community' not in data:
+        data['community'] = fetch_community_stats(day)
+    if 'tips' in needs:
+        data['tips'] = fetch_active_tips()
+    return data
+
+# Response builders keyed by intent name: name -> (handler, needs)
+INTENT_HANDLERS = {}
+
+def intent_handler(name, needs=()):
+    """Register handler(template, user_id, data) for an intent name
+
+    needs lists the data to prefetch before the call: 'user' (the per-user
+    daily bundle), 'community' and/or 'tips'.
+    """
+    def decorator(handler):
+        INTENT_HANDLERS[name] = (handler, frozenset(needs))
+        return handler
+    return decorator
+
+@intent_handler('greenest_time')
+def respond_greenest_time(template, user_id, data):
+    # Cheapest period of the tariff in effect today
+    window = tariff_engine.greenest_window(data['today'])
+    if window:
+        start, end, rate_type, _ = window
+        label = rate_type.replace('_', '-')
+        return template.format(green_time=f"during {label} hours ({start} - {end}) when renewable energy is more prevalent on the grid")
+    
+    return template.format(green_time="during off-peak hours (10 PM - 6 AM) when renewable energy is more prevalent on the grid")
+
+@intent_handler('query_electricity_today', needs=('user',))
+def respond_electricity_today(template, user_id, data):
+    usage = data.get('user', {}).get('usage', {}).get(data['today'])
+    if usage:
+        return template.format(kwh=usage[0], cost=usage[1])
+    
+    # Fallback to sample data
+    return template.format(kwh=5.6, cost=2.08)
+
+@intent_handler('query_community_usage', needs=('community',))
+def respond_community_usage(template, user_id, data):
+    community_data = data.get('community')
+    if community_data:
+        return template.format(avg_kwh=community_data[0])
+    
+    # Fallback to sample data
+    return template.format(avg_kwh=5.2)
+
+@intent_handler('compare_yesterday', needs=('user',))
+def respond_compare_yesterday(template, user_id, data):
+    usage = data.get('user', {}).get('usage', {})
+    today_usage = usage.get(data['today'])
+    yesterday_usage = usage.get(data['yesterday'])
+    if today_usage and yesterday_usage:
+        today_kwh, yesterday_kwh = today_usage[0], yesterday_usage[0]
+        diff = round(abs(today_kwh - yesterday_kwh), 2)
+        compare = "more" if today_kwh > yesterday_kwh else "less"
+        compare_text = "more than yesterday" if today_kwh > yesterday_kwh else "less than yesterday"
+        return template.format(compare=compare, diff=diff, compare_text=compare_text)
+    
+    # Fallback
+    return template.format(compare="less", diff=0.6, compare_text="less than yesterday")
+
+@intent_handler('query_co2_saved', needs=('user',))
+def respond_co2_saved(template, user_id, data):
+    co2 = data.get('user', {}).get('impact', {}).get('CO2_saved')
+    if co2 is not None:
+        return template.format(co2=co2)
+    
+    # Fallback
+    return template.format(co2=2.1)
+
+@intent_handler('random_tip', needs=('tips',))
+def respond_random_tip(template, user_id, data):
+    tips = data.get('tips')
+    if tips:
+        return template.format(tip=random.choice(tips))
+    
+    # Fallback
+    return template.format(tip="Turn off lights when leaving a room to save energy")
+
+@intent_handler('query_water_saved', needs=('user',))
+def respond_water_saved(template, user_id, data):
+    water = data.get('user', {}).get('impact', {}).get('water_saved')
+    if water is not None:
+        return template.format(water=water)
+    
+    # Fallback
+    return template.format(water=15.0)
+
+@intent_handler('query_money_saved_week', needs=('user',))
+def respond_money_saved_week(template, user_id, data):
+    # Savings from time-of-use pricing: the week's kWh at the flat (standard) rate minus
+    # what it actually cost, not a fixed weekly budget minus cost
+    bundle = data.get('user', {})
+    total_cost = bundle.get('week_cost')
+    baseline_cost = tariff_engine.flat_cost(bundle.get('week_kwh'), data['today'])
+    if total_cost and baseline_cost is not None:
+        savings = round(max(0, baseline_cost - total_cost), 2)
+        return template.format(money=savings)
+    
+    # Fallback
+    return template.format(money=2.98)
+
+@intent_handler('compare_community', needs=('user', 'community'))
+def respond_compare_community(template, user_id, data):
+    # User's today usage against the community average
+    user_usage = data.get('user', {}).get('usage', {}).get(data['today'])
+    community_avg = data.get('community')
+    if user_usage and community_avg:
+        user_kwh = user_usage[0]
+        avg_kwh = community_avg[0]
+        diff = round(abs(user_kwh - avg_kwh), 2)
+        compare = "less" if user_kwh < avg_kwh else "more"
+        compare_text = "than your community average"
+        return template.format(compare=compare, diff=diff, compare_text=compare_text)
+    
+    # Fallback
+    return template.format(compare="less", diff=0.4, compare_text="than your community average")
+
+@intent_handler('summary_today', needs=('user',))
+def respond_summary_today(template, user_id, data):
+    bundle = data.get('user')
+    if bundle:
+        usage_data = bundle['usage'].get(data['today'])
+        co2 = bundle['impact'].get('CO2_saved')
+        kwh = usage_data[0] if usage_data else 5.6
+        co2 = co2 if co2 is not None else 2.1
+        return template.format(kwh=kwh, co2=co2)
+    
+    # Fallback
+    return template.format(kwh=5.6, co2=2.1)
+
+def intent_needs(intent_id):
+    """The data an intent's handler prefetches (empty for static and unknown intents)"""
+    intent_data = fetch_intent(intent_id)
+    handler_entry = INTENT_HANDLERS.get(intent_data[0]) if intent_data else None
+    return handler_entry[1] if handler_entry else frozenset()
+
+def get_response(intent_id, user_id=None, data=None):
+    """Get dynamic response based on intent and database data
+
+    data may carry the handler's data already resolved (see answer_batch),
+    including 'today' and 'yesterday'; otherwise it is fetched here.
+    """
     # Get intent information
-    cursor.execute('SELECT name, response_template, requires_data_access FROM Intent WHERE intent_id = ?', (intent_id,))
-    intent_data = cursor.fetchone()
+    intent_data = fetch_intent(intent_id)
     
     if not intent_data:
-        conn.close()
         return "I'm here to help you live more sustainably! Ask me about electricity usage, appliance efficiency, or eco-friendly choices."
     
     intent_name, response_template, requires_data_access = intent_data
+    handler_entry = INTENT_HANDLERS.get(intent_name)
     
-    if not requires_data_access:
-        # For intents that don't need data, return template as-is or with static values
-        if intent_name == 'greenest_time':
-            return response_template.format(green_time="during off-peak hours (10 PM - 6 AM) when renewable energy is more prevalent on the grid")
-        return response_template
+    if not handler_entry:
+        # Intents without data return their template as-is
+        if not requires_data_access:
+            return response_template.text
+        return "I'm here to help you live more sustainably! Ask me about electricity usage, appliance efficiency, or eco-friendly choices."
     
-    # For data-driven intents, query the database and format the response
-    # Use fixed sample data date instead of current date
-    today = "2025-01-23"  # Fixed sample data date
+    handler, needs = handler_entry
     
     try:
-        if intent_name == 'query_electricity_today':
-            if user_id:
-                cursor.execute('''
-                    SELECT kwh_used, estimated_cost FROM Electricity_Usage 
-                    WHERE user_id = ? AND date = ?
-                ''', (user_id, today))
-                usage_data = cursor.fetchone()
-                if usage_data:
-                    kwh, cost = usage_data
-                    return response_template.format(kwh=kwh, cost=cost)
-            
-            # Fallback to sample data
-            return response_template.format(kwh=5.6, cost=2.08)
-        
-        elif intent_name == 'query_community_usage':
-            cursor.execute('''
-                SELECT avg_kwh_per_user FROM Community_Stats 
-                WHERE date = ? ORDER BY created_at DESC LIMIT 1
-            ''', (today,))
-            community_data = cursor.fetchone()
-            if community_data:
-                avg_kwh = community_data[0]
-                return response_template.format(avg_kwh=avg_kwh)
-            
-            # Fallback to sample data
-            return response_template.format(avg_kwh=5.2)
-        
-        elif intent_name == 'compare_yesterday':
-            if user_id:
-                yesterday = "2025-01-22"  # Fixed sample data date for yesterday
-                cursor.execute('''
-                    SELECT kwh_used FROM Electricity_Usage 
-                    WHERE user_id = ? AND date IN (?, ?)
-                    ORDER BY date DESC
-                ''', (user_id, today, yesterday))
-                usage_data = cursor.fetchall()
-                if len(usage_data) >= 2:
-                    today_kwh, yesterday_kwh = usage_data[0][0], usage_data[1][0]
-                    diff = round(abs(today_kwh - yesterday_kwh), 2)
-                    compare = "more" if today_kwh > yesterday_kwh else "less"
-                    compare_text = "more than yesterday" if today_kwh > yesterday_kwh else "less than yesterday"
-                    return response_template.format(compare=compare, diff=diff, compare_text=compare_text)
-            
-            # Fallback
-            return response_template.format(compare="less", diff=0.6, compare_text="less than yesterday")
-        
-        elif intent_name == 'query_co2_saved':
-            if user_id:
-                cursor.execute('''
-                    SELECT impact_value FROM Impact_Record 
-                    WHERE user_id = ? AND date = ? AND impact_type = 'CO2_saved'
-                ''', (user_id, today))
-                co2_data = cursor.fetchone()
-                if co2_data:
-                    co2 = co2_data[0]
-                    return response_template.format(co2=co2)
-            
-            # Fallback
-            return response_template.format(co2=2.1)
-        
-        elif intent_name == 'random_tip':
-            cursor.execute('''
-                SELECT content FROM Tip 
-                WHERE is_active = 1 
-                ORDER BY RANDOM() LIMIT 1
-            ''')
-            tip_data = cursor.fetchone()
-            if tip_data:
-                tip = tip_data[0]
-                return response_template.format(tip=tip)
-            
-            # Fallback
-            return response_template.format(tip="Turn off lights when leaving a room to save energy")
-        
-        elif intent_name == 'query_water_saved':
-            if user_id:
-                cursor.execute('''
-                    SELECT impact_value FROM Impact_Record 
-                    WHERE user_id = ? AND date = ? AND impact_type = 'water_saved'
-                ''', (user_id, today))
-                water_data = cursor.fetchone()
-                if water_data:
-                    water = water_data[0]
-                    return response_template.format(water=water)
-            
-            # Fallback
-            return response_template.format(water=15.0)
-        
-        elif intent_name == 'query_money_saved_week':
-            if user_id:
-                # Calculate weekly savings (simplified)
-                cursor.execute('''
-                    SELECT SUM(estimated_cost) FROM Electricity_Usage 
-                    WHERE user_id = ? AND date >= date(?, '-7 days')
-                ''', (user_id, today))
-                cost_data = cursor.fetchone()
-                if cost_data and cost_data[0]:
-                    # Assume baseline cost and calculate savings
-                    total_cost = cost_data[0]
-                    baseline_cost = 17.0  # Weekly baseline in euros
-                    savings = round(max(0, baseline_cost - total_cost), 2)
-                    return response_template.format(money=savings)
-            
-            # Fallback
-            return response_template.format(money=2.98)
-        
-        elif intent_name == 'compare_community':
-            if user_id:
-                # Get user's today usage
-                cursor.execute('''
-                    SELECT kwh_used FROM Electricity_Usage 
-                    WHERE user_id = ? AND date = ?
-                ''', (user_id, today))
-                user_usage = cursor.fetchone()
-                
-                # Get community average
-                cursor.execute('''
-                    SELECT avg_kwh_per_user FROM Community_Stats 
-                    WHERE date = ? ORDER BY created_at DESC LIMIT 1
-                ''', (today,))
-                community_avg = cursor.fetchone()
-                
-                if user_usage and community_avg:
-                    user_kwh = user_usage[0]
-                    avg_kwh = community_avg[0]
-                    diff = round(abs(user_kwh - avg_kwh), 2)
-                    compare = "less" if user_kwh < avg_kwh else "more"
-                    compare_text = "than your community average"
-                    return response_template.format(compare=compare, diff=diff, compare_text=compare_text)
-            
-            # Fallback
-            return response_template.format(compare="less", diff=0.4, compare_text="than your community average")
-        
-        elif intent_name == 'summary_today':
-            if user_id:
-                cursor.execute('''
-                    SELECT kwh_used FROM Electricity_Usage 
-                    WHERE user_id = ? AND date = ?
-                ''', (user_id, today))
-                usage_data = cursor.fetchone()
-                
-                cursor.execute('''
-                    SELECT impact_value FROM Impact_Record 
-                    WHERE user_id = ? AND date = ? AND impact_type = 'CO2_saved'
-                ''', (user_id, today))
-                co2_data = cursor.fetchone()
-                
-                kwh = usage_data[0] if usage_data else 5.6
-                co2 = co2_data[0] if co2_data else 2.1
-                return response_template.format(kwh=kwh, co2=co2)
-            
-            # Fallback
-            return response_template.format(kwh=5.6, co2=2.1)
-        
+        if data is None:
+            today = user_today(user_id)
+            data = prefetch_response_data(needs, user_id, today) if needs else {}
+            data['today'] = today
+            data['yesterday'] = previous_day(today)
+        return handler(response_template, user_id, data)
     except Exception as e:
         print(f"Error getting response for intent {intent_id}: {e}")
     
-    conn.close()
-    
     # Fallback to default response
     return "I'm here to help you live more sustainably! Ask me about electricity usage, appliance efficiency, or eco-friendly choices."
 
+# Return the answer before synthesis finishes; set TTS_ASYNC=0 to wait for the audio
+TTS_ASYNC = os.environ.get('TTS_ASYNC', '1') != '0'
+# How long a request for audio that is still being synthesized waits for new bytes
+TTS_WAIT_TIMEOUT = float(os.environ.get('TTS_WAIT_TIMEOUT', '15'))
+# Content-addressed clips never change, so clients may keep them for a year
+AUDIO_CACHE_MAX_AGE = 365 * 24 * 3600
+AUDIO_STREAM_CHUNK_SIZE = 16 * 1024
+AUDIO_STREAM_POLL_INTERVAL = 0.05
 
-
-
+audio_storage = AudioStorage()
+tts_service = TTSService(cache=audio_storage)
 
 def text_to_speech(text, filename):
     """Convert text to speech and save as MP3"""
-    try:
-        tts = gTTS(text=text, lang='en', slow=False)
-        tts.save(filename)
-        return True
-    except Exception as e:
-        print(f"Error in text-to-speech: {e}")
-        return False
+    return tts_service.synthesize(text, filename)
+
+def prewarm_tts_cache():
+    """Queue audio for answers that never change: static intents and every active tip"""
+    answers = []
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT intent_id FROM Intent WHERE requires_data_access = 0')
+        static_intents = [row[0] for row in cursor.fetchall()]
+        
+        try:
+            cursor.execute("SELECT response_template FROM Intent WHERE name = 'random_tip'")
+            tip_template = cursor.fetchone()
+            if tip_template:
+                cursor.execute('SELECT content FROM Tip WHERE is_active = 1')
+                answers.extend(tip_template[0].format(tip=row[0]) for row in cursor.fetchall())
+        except sqlite3.Error as e:
+            print(f"Error collecting tips to pre-warm: {e}")
+    
+    answers.extend(get_response(intent_id) for intent_id in static_intents)
+    tts_service.prewarm(answers)
+
+def build_audio_url(filename, url_root=None):
+    """Public URL for a generated audio file"""
+    if os.environ.get('RAILWAY_ENVIRONMENT'):
+        # For Railway, construct URL using request
+        url_root = url_root or request.url_root
+        return f"{url_root.rstrip('/')}/api/audio/{filename}"
+    return f"{get_base_url(5000)}/api/audio/{filename}"
+
+def audio_fields(job, url_root=None):
+    """The audio fields of the JSON response for a TTS job"""
+    return {
+        'audio_url': build_audio_url(job.filename, url_root) if job.status != TTSJob.FAILED else None,
+        'audio_status': job.status,
+        'audio_job_id': job.job_id,
+    }
+
+def start_answer_audio(answer):
+    """Queue TTS for an answer and return the audio fields for the JSON response"""
+    with span('tts_submit'):
+        job = tts_service.submit(answer)
+    if not TTS_ASYNC:
+        with span('tts_wait'):
+            job.wait(TTS_WAIT_TIMEOUT)
+    
+    return audio_fields(job)
+
+conversation_log = ConversationLogger()
+
+def build_answer(user_message, user_id=None):
+    """Match the intent and build the answer text: (intent, answer)"""
+    with span('match_intent'):
+        intent = match_intent(user_message)
+    with span('get_response'):
+        return intent, get_response(intent, user_id)
+
+def log_answer(user_message, user_id, intent, answer, audio):
+    """Log the conversation and assemble the JSON response"""
+    # Save to database (batched in the background unless CONVERSATION_LOG_MODE=sync)
+    conversation_id = str(uuid.uuid4())
+    with span('conversation_log'):
+        conversation_log.log(conversation_id, user_id, user_message, answer, intent)
+    
+    return {
+        'answer': answer,
+        'audio_url': audio['audio_url'],
+        'audio_status': audio['audio_status'],
+        'audio_job_id': audio['audio_job_id'],
+        'conversation_id': conversation_id,
+        'intent_matched': intent
+    }
+
+def answer_question(user_message, user_id=None):
+    """Match intent, build the answer, queue its audio and log the conversation"""
+    intent, answer = build_answer(user_message, user_id)
+    
+    # Generate audio file in the background
+    audio = start_answer_audio(answer)
+    
+    return log_answer(user_message, user_id, intent, answer, audio)
 
 @app.route('/api/text_ask', methods=['POST'])
 def text_ask():
@@ -459,67 +872,130 @@ def text_ask():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
-        # Match intent and get response
-        intent = match_intent(text)
-        answer = get_response(intent, user_id)
-        
-        # Generate audio file
-        audio_filename = f"answer_{uuid.uuid4()}.mp3"
-        audio_path = os.path.join(os.getcwd(), audio_filename)
-        
-        if text_to_speech(answer, audio_path):
-            if os.environ.get('RAILWAY_ENVIRONMENT'):
-                # For Railway, construct URL using request
-                audio_url = f"{request.url_root.rstrip('/')}/{audio_filename}"
-            else:
-                audio_url = f"{BASE_URL}/{audio_filename}"
-        else:
-            audio_url = None
-        
-        # Save to database
-        conversation_id = str(uuid.uuid4())
-        conn = sqlite3.connect('eco_whisper_demo.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO conversations (conversation_id, user_id, user_message, assistant_message, intent_matched)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (conversation_id, user_id, text, answer, intent))
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            'answer': answer,
-            'audio_url': audio_url,
-            'conversation_id': conversation_id,
-            'intent_matched': intent
-        })
+        return jsonify(answer_question(text, user_id))
         
     except Exception as e:
         print(f"Error in text_ask: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
-@app.route('/api/transcribe', methods=['POST'])
-def transcribe():
-    """Handle voice transcription"""
+# Most questions one /api/text_ask/batch request may carry
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '1000'))
+BATCH_TTS_MODES = ('off', 'deferred')
+
+def resolve_batch_data(items):
+    """Handler data for every item, resolved with grouped queries instead of per item"""
+    user_ids = {item['user_id'] for item in items if item['user_id']}
+    timezones = fetch_user_timezones(user_ids) if user_ids else {}
+    for item in items:
+        item['today'] = local_today(timezones.get(item['user_id']))
+    
+    user_days = {(item['user_id'], item['today']) for item in items
+                 if item['user_id'] and 'user' in item['needs']}
+    community_days = {item['today'] for item in items if 'community' in item['needs']}
+    bundles = load_user_days(user_days)
+    community = load_community_days(community_days)
+    tips = fetch_active_tips() if any('tips' in item['needs'] for item in items) else None
+    
+    for item in items:
+        today = item['today']
+        data = {'today': today, 'yesterday': previous_day(today)}
+        if (item['user_id'], today) in bundles:
+            data['user'] = bundles[(item['user_id'], today)]
+        if 'community' in item['needs']:
+            data['community'] = community.get(today)
+        if 'tips' in item['needs']:
+            data['tips'] = tips
+        item['data'] = data
+
+def answer_batch(questions, tts='off', log=False):
+    """Answer many questions at once: one matcher pass and grouped data queries
+
+    Each question is a dict with 'text', an optional 'user_id' and an optional
+    'tts' ('off' or 'deferred', defaulting to tts). Deferred items queue audio
+    in the background and return its job; nothing waits for synthesis.
+    Conversations are only logged when log is true.
+    """
+    results = [None] * len(questions)
+    items = []
+    for position, question in enumerate(questions):
+        if not isinstance(question, dict):
+            results[position] = {'error': 'Question must be an object'}
+            continue
+        text = str(question.get('text') or '').strip()
+        item_tts = question.get('tts', tts)
+        if not text:
+            results[position] = {'error': 'No text provided'}
+        elif item_tts not in BATCH_TTS_MODES:
+            results[position] = {'error': f"tts must be one of {', '.join(BATCH_TTS_MODES)}"}
+        else:
+            user_id = question.get('user_id')
+            items.append({'position': position, 'text': text, 'tts': item_tts,
+                          'user_id': str(user_id) if user_id else None})
+    
+    for item, intent in zip(items, match_intents([item['text'] for item in items])):
+        item['intent'] = intent
+        item['needs'] = intent_needs(intent)
+    resolve_batch_data(items)
+    
+    for item in items:
+        answer = get_response(item['intent'], item['user_id'], item['data'])
+        result = {'answer': answer, 'intent_matched': item['intent'], 'user_id': item['user_id']}
+        if item['tts'] == 'deferred':
+            result.update(audio_fields(tts_service.submit(answer)))
+        if log:
+            result['conversation_id'] = str(uuid.uuid4())
+            conversation_log.log(result['conversation_id'], item['user_id'], item['text'], answer, item['intent'])
+        results[item['position']] = result
+    return results
+
+@app.route('/api/text_ask/batch', methods=['POST'])
+def text_ask_batch():
+    """Answer a JSON batch: {"questions": [{"text": ..., "user_id": ...}], "tts": "off", "log": false}"""
     try:
-        if 'audio' not in request.files:
-            return jsonify({'error': 'No audio file provided'}), 400
-        
-        audio_file = request.files['audio']
-        user_id = request.form.get('user_id', None)  # Optional user ID
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('questions'), list):
+            return jsonify({'error': 'Expected a JSON object with a questions array'}), 400
+        questions = payload['questions']
+        if len(questions) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'At most {BATCH_MAX_ITEMS} questions per batch'}), 400
+        tts = payload.get('tts', 'off')
+        if tts not in BATCH_TTS_MODES:
+            return jsonify({'error': f"tts must be one of {', '.join(BATCH_TTS_MODES)}"}), 400
         
-        if audio_file.filename == '':
-            return jsonify({'error': 'No audio file selected'}), 400
+        results = answer_batch(questions, tts=tts, log=bool(payload.get('log', False)))
+        return jsonify({'count': len(results), 'results': results})
         
-        # Save audio file temporarily with original extension
-        file_extension = os.path.splitext(audio_file.filename)[1] if audio_file.filename else '.wav'
-        temp_audio_path = f"temp_audio_{uuid.uuid4()}{file_extension}"
-        audio_file.save(temp_audio_path)
+    except Exception as e:
+        print(f"Error in text_ask_batch: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+speech_pool = RecognizerPool()
+
+def transcribe_pcm(pcm):
+    """Recognize 16 kHz mono PCM, mapping failures to the messages we speak back"""
+    if not pcm:
+        return "I didn't catch that. Can you try again?"
+    try:
+        return speech_pool.recognize(pcm, TARGET_SAMPLE_RATE, TARGET_SAMPLE_WIDTH)
+    except SpeechNotUnderstood:
+        return "I didn't catch that. Can you try again?"
+    except SpeechServiceError as e:
+        print(f"Error transcribing audio: {e}")
+        return "Sorry, there was an error with the speech recognition service"
+
+def decode_audio_with_temp_files(audio_bytes, file_extension):
+    """Fallback decode: write the upload to disk, convert with ffmpeg and read it back"""
+    temp_audio_path = audio_storage.temp_path(file_extension)
+    converted_audio_path = None
+    try:
+        with open(temp_audio_path, 'wb') as f:
+            f.write(audio_bytes)
         
         # Convert to WAV if needed for speech recognition
         wav_audio_path = temp_audio_path
         if file_extension.lower() not in ['.wav', '.wave']:
-            wav_audio_path = f"temp_audio_{uuid.uuid4()}.wav"
+            converted_audio_path = audio_storage.temp_path('.wav')
+            wav_audio_path = converted_audio_path
             try:
                 # Use ffmpeg to convert audio to WAV format
                 subprocess.run([
@@ -535,87 +1011,228 @@ def transcribe():
                 wav_audio_path = temp_audio_path
                 print("Warning: ffmpeg not available, using original audio file")
         
-        # Transcribe audio using speech recognition
-        recognizer = sr.Recognizer()
-        try:
-            with sr.AudioFile(wav_audio_path) as source:
-                audio_data = recognizer.record(source)
-                try:
-                    transcript = recognizer.recognize_google(audio_data)
-                except sr.UnknownValueError:
-                    transcript = "I didn't catch that. Can you try again?"
-                except sr.RequestError:
-                    transcript = "Sorry, there was an error with the speech recognition service"
-        except Exception as e:
-            print(f"Error transcribing audio: {e}")
-            transcript = "I didn't catch that. Can you try again?"
+        with sr.AudioFile(wav_audio_path) as source:
+            audio_data = sr.Recognizer().record(source)
+        return audio_data.get_raw_data(convert_rate=TARGET_SAMPLE_RATE, convert_width=TARGET_SAMPLE_WIDTH)
+    except Exception as e:
+        print(f"Error decoding audio: {e}")
+        return None
+    finally:
+        # Clean up temporary files, even if conversion failed
+        audio_storage.discard(temp_audio_path, converted_audio_path)
+
+@app.route('/api/transcribe', methods=['POST'])
+def transcribe():
+    """Handle voice transcription"""
+    try:
+        if 'audio' not in request.files:
+            return jsonify({'error': 'No audio file provided'}), 400
         
-        # Clean up temporary files
-        try:
-            os.remove(temp_audio_path)
-            if wav_audio_path != temp_audio_path:
-                os.remove(wav_audio_path)
-        except:
-            pass
-        
-        # Match intent and get response
-        intent = match_intent(transcript)
-        answer = get_response(intent, user_id)
-        
-        # Generate audio file
-        audio_filename = f"answer_{uuid.uuid4()}.mp3"
-        audio_path = os.path.join(os.getcwd(), audio_filename)
-        
-        if text_to_speech(answer, audio_path):
-            if os.environ.get('RAILWAY_ENVIRONMENT'):
-                # For Railway, construct URL using request
-                audio_url = f"{request.url_root.rstrip('/')}/{audio_filename}"
-            else:
-                audio_url = f"{BASE_URL}/{audio_filename}"
-        else:
-            audio_url = None
+        audio_file = request.files['audio']
+        user_id = request.form.get('user_id', None)  # Optional user ID
         
-        # Save to database
-        conversation_id = str(uuid.uuid4())
-        conn = sqlite3.connect('eco_whisper_demo.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO conversations (conversation_id, user_id, user_message, assistant_message, intent_matched)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (conversation_id, user_id, transcript, answer, intent))
-        conn.commit()
-        conn.close()
+        if audio_file.filename == '':
+            return jsonify({'error': 'No audio file selected'}), 400
         
-        return jsonify({
-            'transcript': transcript,
-            'answer': answer,
-            'audio_url': audio_url,
-            'conversation_id': conversation_id,
-            'intent_matched': intent
-        })
+        file_extension = os.path.splitext(audio_file.filename)[1] if audio_file.filename else '.wav'
+        with span('upload'):
+            audio_bytes = audio_file.read()
+        
+        # Decode to 16 kHz mono PCM in memory; fall back to ffmpeg with temp files
+        with span('decode'):
+            try:
+                pcm = decode_audio(audio_bytes, file_extension)
+            except AudioDecodeError as e:
+                print(f"In-memory audio decode failed ({e}), falling back to ffmpeg temp files")
+                pcm = decode_audio_with_temp_files(audio_bytes, file_extension)
+        
+        # Transcribe audio on the recognizer pool
+        with span('recognize'):
+            transcript = transcribe_pcm(pcm)
+        
+        # Match intent, answer and log the conversation
+        response = answer_question(transcript, user_id)
+        response['transcript'] = transcript
+        return jsonify(response)
         
     except Exception as e:
         print(f"Error in transcribe: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+# Upload bytes read per iteration of the streaming transcription loop
+STREAM_READ_SIZE = 32 * 1024
+# Segments recognized concurrently for one stream
+STREAM_RECOGNITION_CONCURRENCY = int(os.environ.get('STREAM_RECOGNITION_CONCURRENCY', '2'))
+# Segments recognized or queued before the upload stops being read, which bounds buffered audio
+STREAM_MAX_PENDING_SEGMENTS = STREAM_RECOGNITION_CONCURRENCY * 2
+
+def recognize_segment(pcm):
+    """Recognize one utterance of a stream; unintelligible segments give empty text"""
+    try:
+        return speech_pool.recognize(pcm, TARGET_SAMPLE_RATE, TARGET_SAMPLE_WIDTH)
+    except SpeechNotUnderstood:
+        return ''
+    except SpeechServiceError as e:
+        print(f"Error transcribing stream segment: {e}")
+        return ''
+
+@app.route('/api/transcribe/stream', methods=['POST'])
+def transcribe_stream():
+    """Transcribe a chunked upload segment by segment, streaming partial transcripts as NDJSON
+
+    The body is raw 16-bit PCM (?format=pcm&sample_rate=16000&channels=1) or a
+    PCM WAV stream (?format=wav). Each line of the response is a JSON object:
+    {"type": "partial", ...} per recognized segment, then one {"type": "final", ...}
+    carrying the full transcript and the usual answer fields.
+    """
+    user_id = request.args.get('user_id') or request.headers.get('X-User-Id')
+    stream_format = request.args.get('format', 'pcm')
+    
+    try:
+        if stream_format == 'wav':
+            sample_rate, channels, sample_width = read_wav_header(request.stream.read)
+        else:
+            sample_rate = int(request.args.get('sample_rate', TARGET_SAMPLE_RATE))
+            channels = int(request.args.get('channels', 1))
+            sample_width = TARGET_SAMPLE_WIDTH
+        converter = PCMStreamConverter(sample_rate, channels, sample_width)
+    except (AudioDecodeError, ValueError) as e:
+        return jsonify({'error': f'Unsupported audio stream: {e}'}), 400
+    
+    def generate():
+        segmenter = SpeechSegmenter()
+        pending = deque()
+        texts = []
+        
+        def drain(block):
+            # Emit finished segments in order; block=True waits for all of them, and a
+            # full queue waits for the oldest so the body is not read ahead of recognition
+            while pending and (block or pending[0][1].done() or len(pending) >= STREAM_MAX_PENDING_SEGMENTS):
+                index, future = pending.popleft()
+                text = future.result()
+                if text:
+                    texts.append(text)
+                yield json.dumps({'type': 'partial', 'segment': index, 'text': text}) + '\n'
+        
+        with ThreadPoolExecutor(max_workers=STREAM_RECOGNITION_CONCURRENCY) as executor:
+            segment_count = 0
+            while True:
+                chunk = request.stream.read(STREAM_READ_SIZE)
+                if not chunk:
+                    break
+                for segment in segmenter.feed(converter.convert(chunk)):
+                    pending.append((segment_count, executor.submit(recognize_segment, segment)))
+                    segment_count += 1
+                    yield from drain(block=False)
+                yield from drain(block=False)
+            
+            segment = segmenter.flush()
+            if segment:
+                pending.append((segment_count, executor.submit(recognize_segment, segment)))
+            yield from drain(block=True)
+        
+        # Final intent matching runs on the assembled transcript
+        transcript = ' '.join(texts) or "I didn't catch that. Can you try again?"
+        try:
+            response = answer_question(transcript, user_id)
+        except Exception as e:
+            print(f"Error in transcribe_stream: {e}")
+            yield json.dumps({'type': 'error', 'error': 'Internal server error'}) + '\n'
+            return
+        response['type'] = 'final'
+        response['transcript'] = transcript
+        yield json.dumps(response) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+rollup_engine = RollupEngine()
+meter_ingestor = MeterReadingIngestor(rollups=rollup_engine, tariffs=tariff_engine)
+
+@app.route('/api/ingest/meter_readings', methods=['POST'])
+def ingest_meter_readings():
+    """Bulk-load smart-meter readings sent as NDJSON or CSV (with a header row)"""
+    is_csv = request.mimetype == 'text/csv' or request.args.get('format') == 'csv'
+    # Parse the body as it arrives instead of buffering the whole upload
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='' if is_csv else None)
+    records = iter_csv(lines) if is_csv else iter_ndjson(lines)
+    
+    try:
+        summary = meter_ingestor.ingest(records)
+    except UnicodeDecodeError:
+        return jsonify({'error': 'Body must be UTF-8 encoded'}), 400
+    except csv.Error as e:
+        return jsonify({'error': f'Invalid CSV: {e}'}), 400
+    except Exception as e:
+        print(f"Error ingesting meter readings: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    for user_id in summary['users_updated']:
+        response_cache.invalidate_user(user_id)
+    if summary['days_updated']:
+        response_cache.invalidate('community')
+    
+    return jsonify(summary)
+
+@app.route('/api/rollups/backfill', methods=['POST'])
+def backfill_rollups():
+    """Rebuild community and impact rollups for a date range from Electricity_Usage
+
+    Replaces the range's Community_Stats and users' Impact_Record values,
+    including hand-entered sample rows.
+    """
+    data = request.get_json(silent=True) or {}
+    start_date = data.get('start_date')
+    end_date = data.get('end_date', start_date)
+    try:
+        if date.fromisoformat(start_date) > date.fromisoformat(end_date):
+            return jsonify({'error': 'start_date must not be after end_date'}), 400
+    except (TypeError, ValueError):
+        return jsonify({'error': 'start_date and end_date must be YYYY-MM-DD dates'}), 400
+    
+    try:
+        user_days = rollup_engine.backfill(start_date, end_date)
+    except Exception as e:
+        print(f"Error backfilling rollups: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    response_cache.invalidate('community')
+    response_cache.invalidate('user')
+    return jsonify({'start_date': start_date, 'end_date': end_date, 'user_days': user_days})
+
+@app.route('/api/tariffs/recompute', methods=['POST'])
+def recompute_tariff_costs():
+    """Reload electricity_rates and reprice usage between two dates, optionally for one community"""
+    data = request.get_json(silent=True) or {}
+    if not data.get('start_date'):
+        return jsonify({'error': 'start_date and end_date must be YYYY-MM-DD dates'}), 400
+    try:
+        start_date, end_date = parse_date_range(data['start_date'], data.get('end_date', data['start_date']),
+                                                local_today(), max_days=None, names=('start_date', 'end_date'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        started = time.monotonic()
+        user_days = tariff_engine.recompute(start_date, end_date, data.get('community_id'))
+    except Exception as e:
+        print(f"Error recomputing costs: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    response_cache.invalidate('user')
+    return jsonify({
+        'start_date': start_date,
+        'end_date': end_date,
+        'user_days': user_days,
+        'seconds': round(time.monotonic() - started, 3)
+    })
+
 @app.route('/api/usage/community/today', methods=['GET'])
 def community_usage_today():
     """Get community usage for today"""
     try:
-        today = "2025-01-23"  # Fixed sample data date
-        
-        conn = sqlite3.connect('eco_whisper_demo.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT avg_kwh_per_user, total_co2_saved 
-            FROM Community_Stats 
-            WHERE date = ? 
-            ORDER BY created_at DESC LIMIT 1
-        ''', (today,))
+        today = local_today()
         
-        result = cursor.fetchone()
-        conn.close()
+        result = fetch_community_stats(today)
         
         if result:
             avg_kwh, co2_saved = result
@@ -640,19 +1257,9 @@ def community_usage_today():
 def user_usage_today(user_id):
     """Get user's electricity usage for today"""
     try:
-        today = "2025-01-23"  # Fixed sample data date
+        today = user_today(user_id)
         
-        conn = sqlite3.connect('eco_whisper_demo.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT kwh_used, estimated_cost, is_peak_time 
-            FROM Electricity_Usage 
-            WHERE user_id = ? AND date = ?
-        ''', (user_id, today))
-        
-        result = cursor.fetchone()
-        conn.close()
+        result = fetch_usage(user_id, today)
         
         if result:
             kwh_used, estimated_cost, is_peak_time = result
@@ -670,15 +1277,280 @@ def user_usage_today(user_id):
         print(f"Error getting user usage: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def parse_range_args(today):
+    """(start, end, granularity) from the query string; raises ValueError"""
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in RANGE_PERIODS:
+        raise ValueError(f"granularity must be one of: {', '.join(RANGE_PERIODS)}")
+    start, end = parse_date_range(request.args.get('start'), request.args.get('end'), today)
+    return start, end, granularity
+
+@app.route('/api/usage/user/<user_id>/range', methods=['GET'])
+def user_usage_range(user_id):
+    """Get a user's usage series, e.g. ?start=2025-01-01&end=2025-01-31&granularity=week"""
+    try:
+        start, end, granularity = parse_range_args(user_today(user_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        series = load_usage_range(user_id, start, end, granularity)
+        return jsonify({
+            'user_id': user_id,
+            'start': start,
+            'end': end,
+            'granularity': granularity,
+            'total_kwh': round(sum(point['kwh_used'] for point in series), 2),
+            'total_cost': round(sum(point['estimated_cost'] or 0 for point in series), 2),
+            'series': series
+        })
+    except Exception as e:
+        print(f"Error getting user usage range: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/usage/community/range', methods=['GET'])
+def community_usage_range():
+    """Get a community's daily stats series; community_id defaults to the default community"""
+    community_id = request.args.get('community_id', DEFAULT_COMMUNITY_ID)
+    try:
+        start, end, granularity = parse_range_args(local_today())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        return jsonify({
+            'community_id': community_id,
+            'start': start,
+            'end': end,
+            'granularity': granularity,
+            'series': load_community_range(community_id, start, end, granularity)
+        })
+    except Exception as e:
+        print(f"Error getting community usage range: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+conversation_archiver = ConversationArchiver()
+
+@app.route('/api/conversations/<user_id>', methods=['GET'])
+def conversation_history(user_id):
+    """Get a user's conversations, newest first; pass next_cursor back as ?cursor= for the next page"""
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if not 1 <= limit <= HISTORY_MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}'}), 400
+    
+    try:
+        with db_span('conversation_history'):
+            turns, next_cursor = fetch_history_page(user_id, limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error getting conversation history: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    return jsonify({
+        'user_id': user_id,
+        'conversations': [{
+            'conversation_id': turn['conversation_id'],
+            'user_message': turn['user_message'],
+            'assistant_message': turn['assistant_message'],
+            'intent_matched': turn['intent_matched'],
+            'timestamp': turn['timestamp'],
+        } for turn in turns],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/conversations/retention', methods=['POST'])
+def archive_conversations():
+    """Move conversations older than retention_days (default CONVERSATION_RETENTION_DAYS) to the archive"""
+    data = request.get_json(silent=True) or {}
+    retention_days = data.get('retention_days')
+    if retention_days is not None and (not isinstance(retention_days, int) or retention_days < 0):
+        return jsonify({'error': 'retention_days must be a non-negative integer'}), 400
+    
+    try:
+        return jsonify(conversation_archiver.run(retention_days))
+    except Exception as e:
+        print(f"Error archiving conversations: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/audio/status/<job_id>', methods=['GET'])
+def audio_status(job_id):
+    """Poll the status of a background TTS job"""
+    job = tts_service.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown audio job'}), 404
+    
+    status = job.to_dict()
+    status['audio_url'] = build_audio_url(job.filename) if job.status != TTSJob.FAILED else None
+    return jsonify(status)
+
+def stream_pending_audio(job):
+    """Yield MP3 bytes from a job's partial file while the TTS backend is still writing it"""
+    part_path = job.temp_path
+    deadline = time.monotonic() + TTS_WAIT_TIMEOUT
+    audio = None
+    try:
+        # Wait for the worker to create the file (the job may still be queued)
+        while audio is None:
+            for candidate in (part_path, job.path):
+                try:
+                    audio = open(candidate, 'rb')
+                    break
+                except FileNotFoundError:
+                    pass
+            if audio is None:
+                if job.status == TTSJob.FAILED or time.monotonic() > deadline:
+                    return
+                job.wait(AUDIO_STREAM_POLL_INTERVAL)
+        
+        # The open handle survives the .part -> .mp3 rename, so keep reading until the job ends
+        while True:
+            chunk = audio.read(AUDIO_STREAM_CHUNK_SIZE)
+            if chunk:
+                deadline = time.monotonic() + TTS_WAIT_TIMEOUT
+                yield chunk
+            elif job.done:
+                break
+            elif time.monotonic() > deadline:
+                print(f"Timed out streaming audio for job {job.job_id}")
+                break
+            else:
+                job.wait(AUDIO_STREAM_POLL_INTERVAL)
+    finally:
+        if audio:
+            audio.close()
+
+@app.route('/api/audio/<filename>', methods=['GET'])
+def get_audio(filename):
+    """Serve a synthesized answer with Range/ETag support, streaming it if still in progress"""
+    if not (filename.startswith('tts_') and filename.endswith('.mp3')):
+        return jsonify({'error': 'File not found'}), 404
+    
+    key = filename[len('tts_'):-len('.mp3')]
+    job = tts_service.get(key)
+    if not job or job.status == TTSJob.FAILED:
+        return jsonify({'error': 'File not found'}), 404
+    
+    if not job.done:
+        # Chunked response of the bytes produced so far; not cacheable since it may be cut short
+        response = Response(stream_pending_audio(job), mimetype='audio/mpeg')
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    
+    try:
+        # conditional=True gives us Range (206) and If-None-Match (304) handling
+        response = send_file(job.path, mimetype='audio/mpeg', conditional=True, etag=key, max_age=AUDIO_CACHE_MAX_AGE)
+    except FileNotFoundError:
+        return jsonify({'error': 'File not found'}), 404
+    response.accept_ranges = 'bytes'
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/<filename>')
 def serve_audio(filename):
-    """Serve audio files"""
+    """Serve audio files (legacy URLs)"""
+    if filename.startswith('tts_'):
+        return get_audio(filename)
+    if not filename.endswith('.mp3'):
+        return jsonify({'error': 'File not found'}), 404
+    
     try:
-        return send_file(filename, mimetype='audio/mpeg')
+        return send_file(filename, mimetype='audio/mpeg', conditional=True)
     except FileNotFoundError:
         return jsonify({'error': 'File not found'}), 404
 
+# Metrics: per-request timing, cache effectiveness and the Prometheus endpoint
+def cache_lookups():
+    lookups = {}
+    caches = dict(response_cache.sources, render=render_cache)
+    for source, cache in caches.items():
+        lookups[(source, 'hit')] = cache.hits
+        lookups[(source, 'miss')] = cache.misses
+    return lookups
+
+registry.gauge_callback('eco_whisper_cache_lookups', 'Lookups per in-memory cache since start',
+                        cache_lookups, ('cache', 'result'))
+registry.gauge_callback('eco_whisper_conversation_log_queue', 'Conversation turns waiting to be written',
+                        lambda: {(): conversation_log._queue.qsize()})
+
+@app.before_request
+def start_request_timer():
+    g.request_timer = RequestTimer()
+
+@app.after_request
+def finish_request_timer(response):
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        timer.finish(request.url_rule.rule if request.url_rule else 'unmatched', request.method,
+                     response.status_code)
+    return response
+
+@app.teardown_request
+def finish_failed_request_timer(error=None):
+    # Only reached with the timer still set when the handler raised
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        timer.finish(request.url_rule.rule if request.url_rule else 'unmatched', request.method, 500)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint for this process"""
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Startup. Migrations run separately (python migrations.py), so this only checks the
+# schema version, once in the gunicorn master when the app is preloaded. Background
+# threads don't survive fork, so every serving process starts its own.
+_initialized = False
+_services_pid = None
+_startup_lock = threading.Lock()
+
+def initialize():
+    """Verify the schema version and build in-memory indexes (idempotent)"""
+    global _initialized
+    with _startup_lock:
+        if _initialized:
+            return
+        check_schema_version()
+        intent_index.load()
+        # With preload_app the master forks workers next; they must not inherit open connections
+        db_pool.close_all()
+        _initialized = True
+
+def start_background_services():
+    """Start this process's reaper, log writer, recognizer workers and TTS pre-warm (once per process)"""
+    global _services_pid
+    with _startup_lock:
+        if _services_pid == os.getpid():
+            return
+        _services_pid = os.getpid()
+    audio_storage.start_reaper()
+    conversation_log.start()
+    # Load the speech model now rather than inside the first request's SPEECH_TIMEOUT
+    speech_pool.warm_up()
+    if os.environ.get('TTS_PREWARM', '1') != '0':
+        prewarm_tts_cache()
+
+@app.before_request
+def ensure_background_services():
+    # Covers servers that fork workers without calling start_background_services
+    if _services_pid != os.getpid():
+        start_background_services()
+
+def create_app():
+    """Application factory used by wsgi.py and the development server"""
+    initialize()
+    return app
+
 if __name__ == '__main__':
+    # The development server migrates on start; load sample data with python migrations.py --seed
+    migrate()
+    create_app()
+    start_background_services()
+    
     # Get port from environment variable (Railway) or use default
     port = int(os.environ.get('PORT', 5000))
     
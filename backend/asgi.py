@@ -0,0 +1,139 @@
+"""ASGI entry point: uvicorn asgi:app (or gunicorn with GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker)
+
+The voice and text endpoints run natively on the event loop: ffmpeg decodes
+over asyncio pipes, recognition and TTS are awaited without parking a thread,
+and only the short CPU/SQLite steps (intent matching, templating, logging)
+go to a small executor. Every other route is served by the Flask app.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import app as flask_app
+from audio_decode import decode_audio_async, AudioDecodeError, TARGET_SAMPLE_RATE, TARGET_SAMPLE_WIDTH
+from speech import SpeechNotUnderstood, SpeechServiceError
+from metrics import span, RequestTimer
+
+# Threads for the blocking steps of the async endpoints (intent matching, SQLite, fallbacks)
+ASGI_OFFLOAD_WORKERS = int(os.environ.get('ASGI_OFFLOAD_WORKERS', '8'))
+# Threads serving the Flask routes mounted under the ASGI app
+ASGI_WSGI_WORKERS = int(os.environ.get('ASGI_WSGI_WORKERS', '16'))
+
+offload_executor = ThreadPoolExecutor(max_workers=ASGI_OFFLOAD_WORKERS, thread_name_prefix='asgi-offload')
+
+async def offload(func, *args):
+    """Run a blocking call on the offload executor (in this task's context, so spans reach its timer)"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(offload_executor, context.run, partial(func, *args))
+
+async def transcribe_pcm_async(pcm):
+    """transcribe_pcm without holding a thread while the recognizer works"""
+    if not pcm:
+        return "I didn't catch that. Can you try again?"
+    try:
+        return await flask_app.speech_pool.recognize_async(pcm, TARGET_SAMPLE_RATE, TARGET_SAMPLE_WIDTH)
+    except SpeechNotUnderstood:
+        return "I didn't catch that. Can you try again?"
+    except SpeechServiceError as e:
+        print(f"Error transcribing audio: {e}")
+        return "Sorry, there was an error with the speech recognition service"
+
+async def answer_question_async(user_message, user_id, url_root):
+    """answer_question with the TTS wait awaited instead of blocking"""
+    intent, answer = await offload(flask_app.build_answer, user_message, user_id)
+    
+    with span('tts_submit'):
+        job = flask_app.tts_service.submit(answer)
+    if not flask_app.TTS_ASYNC:
+        with span('tts_wait'):
+            await job.wait_async(flask_app.TTS_WAIT_TIMEOUT)
+    
+    audio = flask_app.audio_fields(job, url_root)
+    return await offload(flask_app.log_answer, user_message, user_id, intent, answer, audio)
+
+async def text_ask(request):
+    try:
+        form = await request.form()
+        text = (form.get('text') or '').strip()
+        user_id = form.get('user_id') or None  # Optional user ID
+        
+        if not text:
+            return JSONResponse({'error': 'No text provided'}, status_code=400)
+        
+        return JSONResponse(await answer_question_async(text, user_id, str(request.base_url)))
+    
+    except Exception as e:
+        print(f"Error in text_ask: {e}")
+        return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+async def transcribe(request):
+    """Handle voice transcription"""
+    try:
+        form = await request.form()
+        audio_file = form.get('audio')
+        user_id = form.get('user_id') or None  # Optional user ID
+        
+        if audio_file is None or isinstance(audio_file, str):
+            return JSONResponse({'error': 'No audio file provided'}, status_code=400)
+        if audio_file.filename == '':
+            return JSONResponse({'error': 'No audio file selected'}, status_code=400)
+        
+        file_extension = os.path.splitext(audio_file.filename)[1] if audio_file.filename else '.wav'
+        with span('upload'):
+            audio_bytes = await audio_file.read()
+        
+        # Decode to 16 kHz mono PCM over async pipes; fall back to ffmpeg with temp files
+        with span('decode'):
+            try:
+                pcm = await decode_audio_async(audio_bytes, file_extension, offload_executor)
+            except AudioDecodeError as e:
+                print(f"In-memory audio decode failed ({e}), falling back to ffmpeg temp files")
+                pcm = await offload(flask_app.decode_audio_with_temp_files, audio_bytes, file_extension)
+        
+        with span('recognize'):
+            transcript = await transcribe_pcm_async(pcm)
+        
+        response = await answer_question_async(transcript, user_id, str(request.base_url))
+        response['transcript'] = transcript
+        return JSONResponse(response)
+    
+    except Exception as e:
+        print(f"Error in transcribe: {e}")
+        return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+def timed(handler):
+    """Record a native endpoint's latency the way the Flask request hooks do"""
+    async def endpoint(request):
+        # No cProfile here: on the event loop it would also capture every other request
+        timer = RequestTimer(profile=False)
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status_code
+            return response
+        finally:
+            timer.finish(request.url.path, request.method, status)
+    return endpoint
+
+def startup():
+    # Runs in each worker process after fork, like gunicorn's post_fork hook
+    flask_app.start_background_services()
+
+app = Starlette(
+    routes=[
+        Route('/api/text_ask', timed(text_ask), methods=['POST']),
+        Route('/api/transcribe', timed(transcribe), methods=['POST']),
+        Mount('/', WSGIMiddleware(flask_app.create_app(), workers=ASGI_WSGI_WORKERS)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    on_startup=[startup],
+)
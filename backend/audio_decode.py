@@ -0,0 +1,179 @@
+"""Decode uploaded audio to 16 kHz mono 16-bit PCM without touching the disk"""
+import asyncio
+import io
+import os
+import subprocess
+import wave
+
+try:
+    import audioop
+except ImportError:  # Removed in Python 3.13; WAV uploads then go through ffmpeg
+    audioop = None
+
+TARGET_SAMPLE_RATE = 16000
+TARGET_SAMPLE_WIDTH = 2
+# Decoding through ffmpeg pipes can be disabled where the binary is missing
+FFMPEG_PIPE_DECODE = os.environ.get('FFMPEG_PIPE_DECODE', '1') != '0'
+FFMPEG_TIMEOUT = float(os.environ.get('FFMPEG_TIMEOUT', '30'))
+
+WAV_EXTENSIONS = ('.wav', '.wave')
+# MP4-family containers may keep their index (moov atom) at the end, which ffmpeg can only reach by seeking
+SEEKABLE_CONTAINER_EXTENSIONS = ('.m4a', '.mp4', '.3gp', '.3g2', '.mov')
+
+class AudioDecodeError(Exception):
+    """Raised when an upload cannot be decoded in memory"""
+
+def decode_wav(data):
+    """Decode a PCM WAV file held in memory"""
+    if audioop is None:
+        raise AudioDecodeError('audioop is not available')
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as wav:
+            channels = wav.getnchannels()
+            width = wav.getsampwidth()
+            rate = wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise AudioDecodeError(f"not a PCM WAV file: {e}")
+
+    return to_target_pcm(frames, width, channels, rate)
+
+def to_target_pcm(frames, width, channels, rate):
+    """Convert raw little-endian PCM to 16 kHz mono 16-bit"""
+    if audioop is None:
+        raise AudioDecodeError('audioop is not available')
+    if width == 1:
+        frames = audioop.bias(frames, 1, -128)  # 8-bit WAV samples are unsigned
+    if width != TARGET_SAMPLE_WIDTH:
+        frames = audioop.lin2lin(frames, width, TARGET_SAMPLE_WIDTH)
+    if channels == 2:
+        frames = audioop.tomono(frames, TARGET_SAMPLE_WIDTH, 0.5, 0.5)
+    elif channels != 1:
+        raise AudioDecodeError(f"unsupported channel count: {channels}")
+    if rate != TARGET_SAMPLE_RATE:
+        frames, _ = audioop.ratecv(frames, TARGET_SAMPLE_WIDTH, 1, rate, TARGET_SAMPLE_RATE, None)
+    return frames
+
+def ffmpeg_command(source):
+    """ffmpeg reading source and writing raw target PCM to stdout"""
+    return [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-i', source,
+        '-f', 's16le',
+        '-acodec', 'pcm_s16le',
+        '-ar', str(TARGET_SAMPLE_RATE),
+        '-ac', '1',
+        'pipe:1'
+    ]
+
+FFMPEG_PIPE_COMMAND = ffmpeg_command('pipe:0')
+
+def needs_seekable_input(data, file_extension):
+    """True for uploads ffmpeg cannot reliably decode from a pipe"""
+    return file_extension.lower() in SEEKABLE_CONTAINER_EXTENSIONS or data[4:8] == b'ftyp'
+
+def stage_in_memory(data):
+    """A seekable in-memory file (memfd) holding data, or None where memfd is unavailable"""
+    if not hasattr(os, 'memfd_create'):
+        return None
+    fd = os.memfd_create('eco-whisper-upload')
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+def decode_with_ffmpeg_pipe(data, seekable=False):
+    """Decode any ffmpeg-readable format over stdin/stdout pipes (no temp files)
+
+    seekable uploads are handed to ffmpeg as an in-memory file instead of
+    stdin; where that isn't possible AudioDecodeError is raised without
+    starting ffmpeg, so the caller's temp-file fallback is the only attempt.
+    """
+    if not FFMPEG_PIPE_DECODE:
+        raise AudioDecodeError('ffmpeg pipe decoding disabled')
+    fd = stage_in_memory(data) if seekable else None
+    if seekable and fd is None:
+        raise AudioDecodeError('container needs a seekable file')
+    try:
+        if fd is None:
+            result = subprocess.run(FFMPEG_PIPE_COMMAND, input=data, capture_output=True, check=True,
+                                    timeout=FFMPEG_TIMEOUT)
+        else:
+            result = subprocess.run(ffmpeg_command(f'/dev/fd/{fd}'), stdin=subprocess.DEVNULL,
+                                    capture_output=True, check=True, timeout=FFMPEG_TIMEOUT, pass_fds=(fd,))
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError) as e:
+        raise AudioDecodeError(f"ffmpeg pipe decode failed: {e}")
+    finally:
+        if fd is not None:
+            os.close(fd)
+    if not result.stdout:
+        raise AudioDecodeError('ffmpeg produced no audio')
+    return result.stdout
+
+def decode_audio(data, file_extension):
+    """Return 16 kHz mono 16-bit PCM for an uploaded file, or raise AudioDecodeError"""
+    if not data:
+        raise AudioDecodeError('empty upload')
+    if file_extension.lower() in WAV_EXTENSIONS or data[:4] == b'RIFF':
+        try:
+            return decode_wav(data)
+        except AudioDecodeError:
+            pass  # Compressed WAV payloads (e.g. float, ADPCM) still decode through ffmpeg
+    return decode_with_ffmpeg_pipe(data, needs_seekable_input(data, file_extension))
+
+async def decode_with_ffmpeg_pipe_async(data, seekable=False):
+    """decode_with_ffmpeg_pipe on asyncio subprocess pipes, so no thread waits on ffmpeg"""
+    if not FFMPEG_PIPE_DECODE:
+        raise AudioDecodeError('ffmpeg pipe decoding disabled')
+    fd = stage_in_memory(data) if seekable else None
+    if seekable and fd is None:
+        raise AudioDecodeError('container needs a seekable file')
+    try:
+        try:
+            if fd is None:
+                process = await asyncio.create_subprocess_exec(
+                    *FFMPEG_PIPE_COMMAND,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+            else:
+                process = await asyncio.create_subprocess_exec(
+                    *ffmpeg_command(f'/dev/fd/{fd}'),
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    pass_fds=(fd,),
+                )
+        except FileNotFoundError as e:
+            raise AudioDecodeError(f"ffmpeg pipe decode failed: {e}")
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(None if fd is not None else data),
+                                                    FFMPEG_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise AudioDecodeError('ffmpeg pipe decode timed out')
+    finally:
+        if fd is not None:
+            os.close(fd)
+    if process.returncode != 0:
+        raise AudioDecodeError(f"ffmpeg pipe decode failed: {stderr.decode(errors='replace').strip()}")
+    if not stdout:
+        raise AudioDecodeError('ffmpeg produced no audio')
+    return stdout
+
+async def decode_audio_async(data, file_extension, executor=None):
+    """decode_audio for event loops: WAV conversion runs on executor, ffmpeg on async pipes"""
+    if not data:
+        raise AudioDecodeError('empty upload')
+    if file_extension.lower() in WAV_EXTENSIONS or data[:4] == b'RIFF':
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, decode_wav, data)
+        except AudioDecodeError:
+            pass
+    return await decode_with_ffmpeg_pipe_async(data, needs_seekable_input(data, file_extension))
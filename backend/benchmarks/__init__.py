@@ -0,0 +1,11 @@
+"""Reproducible benchmarks and load tests (run from the backend directory)
+
+    python -m benchmarks.generate_data --db benchmark.db --users 100000 --days 30 --conversations 1000000
+    DB_PATH=benchmark.db python -m benchmarks.micro
+    DB_PATH=benchmark.db python -m benchmarks.load --requests 5000 --concurrency 32
+    python -m benchmarks.compare benchmarks/results/<before>.json benchmarks/results/<after>.json
+
+Speech recognition and TTS always run on the local stub backends, so the
+numbers measure this code rather than Google's services. Every run saves its
+p50/p95/p99 latencies and throughput as JSON under benchmarks/results/.
+"""
@@ -0,0 +1,54 @@
+"""Compare two saved benchmark runs
+
+    python -m benchmarks.compare benchmarks/results/<before>.json benchmarks/results/<after>.json
+
+Prints each benchmark's p50/p95/p99 and throughput with the relative change;
+latency increases and throughput drops beyond --threshold percent are flagged.
+"""
+import argparse
+import json
+import sys
+
+METRICS = (('p50_ms', False), ('p95_ms', False), ('p99_ms', False), ('throughput_per_s', True))
+
+def load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent change flagged as a regression')
+    args = parser.parse_args(argv if argv is not None else sys.argv[1:])
+
+    before, after = load(args.before), load(args.after)
+    print(f"before: {before['suite']} {before['created_at']} ({before.get('git_revision')})")
+    print(f"after:  {after['suite']} {after['created_at']} ({after.get('git_revision')})")
+    regressions = 0
+    for name in sorted(set(before['results']) | set(after['results'])):
+        old, new = before['results'].get(name), after['results'].get(name)
+        if old is None or new is None:
+            print(f"{name}: only in {'after' if old is None else 'before'}")
+            continue
+        cells = []
+        for metric, higher_is_better in METRICS:
+            delta = change(old.get(metric), new.get(metric))
+            if delta is None:
+                cells.append(f"{metric} n/a")
+                continue
+            worse = -delta if higher_is_better else delta
+            flag = ' !' if worse > args.threshold else ''
+            regressions += bool(flag)
+            cells.append(f"{metric} {old[metric]} -> {new[metric]} ({delta:+.1f}%){flag}")
+        print(f"{name}: " + ', '.join(cells))
+    # A non-zero exit lets CI fail on regressions
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Deterministic synthetic question corpus built from the Intent patterns and keyword rules"""
+import json
+import os
+import random
+
+from db import get_db
+
+INTENT_RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'intent_rules.json')
+
+PREFIXES = ['', '', 'hey, ', 'eco whisper, ', 'can you tell me ', 'quick question: ', 'so ', 'um ']
+SUFFIXES = ['', '', '?', ' please', ' right now?', ' for my flat', ' again', '!']
+# Questions no pattern or rule knows, so every matcher falls through to its default
+OFF_TOPIC = [
+    'what is the weather like',
+    'tell me a joke',
+    'who won the match yesterday',
+    'play some music',
+    'how do I reset my password',
+    'what is the capital of france',
+]
+
+def intent_patterns():
+    """Every question pattern in the Intent table"""
+    patterns = []
+    with get_db() as conn:
+        for (patterns_json,) in conn.execute('SELECT question_patterns FROM Intent'):
+            try:
+                patterns.extend(json.loads(patterns_json or '[]'))
+            except json.JSONDecodeError:
+                continue
+    return patterns
+
+def rule_phrases(path=INTENT_RULES_PATH):
+    """'keyword qualifier' phrases that fire the keyword fallback rules"""
+    with open(path, 'r') as f:
+        config = json.load(f)
+    keyword_sets = config.get('keyword_sets', {})
+    resolve = lambda phrases: keyword_sets[phrases] if isinstance(phrases, str) else phrases
+    phrases = []
+    for rule_set in config.get('rule_sets', {}).values():
+        for rule in rule_set['rules']:
+            qualifiers = resolve(rule['qualifiers']) if rule.get('qualifiers') else ['']
+            for keyword in resolve(rule['keywords']):
+                phrases.extend(f"{keyword} {qualifier}".strip() for qualifier in qualifiers)
+    return phrases
+
+def decorate(rng, text):
+    text = f"{rng.choice(PREFIXES)}{text}{rng.choice(SUFFIXES)}"
+    return text.upper() if rng.random() < 0.05 else text
+
+def question_corpus(size, seed=0, pattern_share=0.6, rule_share=0.3):
+    """size questions: pattern hits, keyword-rule hits and off-topic misses in fixed proportions"""
+    rng = random.Random(seed)
+    patterns = intent_patterns()
+    phrases = rule_phrases()
+    questions = []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < pattern_share and patterns:
+            questions.append(decorate(rng, rng.choice(patterns)))
+        elif roll < pattern_share + rule_share and phrases:
+            questions.append(decorate(rng, f"how does {rng.choice(phrases)} work"))
+        else:
+            questions.append(decorate(rng, rng.choice(OFF_TOPIC)))
+    return questions
@@ -0,0 +1,114 @@
+"""Scale a database up to millions of rows for benchmarking
+
+    python -m benchmarks.generate_data --db benchmark.db --users 100000 --days 30 --conversations 1000000
+
+Creates (or extends) the database through the normal migrations and sample
+data, then adds synthetic users, one Electricity_Usage row per user and day
+ending today, and logged conversations. Rows are keyed deterministically,
+so rerunning with the same arguments inserts nothing new.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+INSERT_BATCH_SIZE = 50000
+TIMEZONES = ['UTC', 'Europe/Berlin', 'Europe/London', 'America/New_York', 'Asia/Tokyo', None]
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=os.environ.get('DB_PATH', 'benchmark.db'))
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=30, help='days of Electricity_Usage per user, ending today')
+    parser.add_argument('--conversations', type=int, default=100000)
+    parser.add_argument('--communities', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rollups', action='store_true',
+                        help='rebuild Community_Stats and Impact_Record for the generated days')
+    return parser.parse_args(argv)
+
+def insert_batches(conn, sql, rows, label):
+    """executemany in INSERT_BATCH_SIZE chunks, committing each; returns rows inserted"""
+    inserted = 0
+    batch = []
+    started = time.monotonic()
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            inserted += max(conn.executemany(sql, batch).rowcount, 0)
+            conn.commit()
+            batch = []
+    if batch:
+        inserted += max(conn.executemany(sql, batch).rowcount, 0)
+        conn.commit()
+    print(f"{label}: {inserted} rows inserted in {time.monotonic() - started:.1f}s")
+    return inserted
+
+def user_rows(args, rng):
+    for i in range(args.users):
+        yield (f'bench_user{i}', f'bench_user{i}', f'bench_user{i}@example.com',
+               f'community{i % args.communities + 1}', rng.choice(TIMEZONES))
+
+def usage_rows(args, rng, days):
+    for i in range(args.users):
+        # Each user has their own typical consumption so comparisons vary
+        typical = rng.uniform(3.0, 12.0)
+        for day in days:
+            kwh = round(max(rng.gauss(typical, typical * 0.2), 0.1), 2)
+            yield (f'bench_{i}_{day}', f'bench_user{i}', day, kwh, round(kwh * rng.uniform(0.2, 0.4), 2),
+                   int(rng.random() < 0.3))
+
+def conversation_rows(args, rng, questions, first_day, span_seconds):
+    for i in range(args.conversations):
+        user_id = f'bench_user{rng.randrange(args.users)}' if args.users else None
+        offset = rng.randrange(span_seconds)
+        timestamp = f"{first_day + timedelta(seconds=offset):%Y-%m-%d %H:%M:%S}"
+        yield (f'bench_conv{i}', user_id, rng.choice(questions), 'Benchmark answer.', None, timestamp)
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    # db.py reads DB_PATH on import
+    os.environ['DB_PATH'] = args.db
+    from db import get_db
+    from dates import local_today
+    from migrations import migrate
+    from benchmarks.corpus import question_corpus
+
+    migrate(seed=True)
+    rng = random.Random(args.seed)
+    end = date.fromisoformat(local_today())
+    days = [(end - timedelta(days=offset)).isoformat() for offset in range(args.days - 1, -1, -1)]
+
+    with get_db() as conn:
+        # Bulk load: a crash only loses the benchmark database
+        conn.execute('PRAGMA synchronous=OFF')
+        insert_batches(conn, '''
+            INSERT OR IGNORE INTO users (user_id, username, email, community_id, timezone) VALUES (?, ?, ?, ?, ?)
+        ''', user_rows(args, rng), 'users')
+        insert_batches(conn, '''
+            INSERT OR IGNORE INTO Electricity_Usage (usage_id, user_id, date, kwh_used, estimated_cost, is_peak_time)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', usage_rows(args, rng, days), 'Electricity_Usage')
+        questions = question_corpus(1000, seed=args.seed)
+        first_day = datetime.fromisoformat(days[0])
+        insert_batches(conn, '''
+            INSERT OR IGNORE INTO conversations (conversation_id, user_id, user_message, assistant_message,
+                                                 intent_matched, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', conversation_rows(args, rng, questions, first_day, args.days * 86400), 'conversations')
+        conn.execute('PRAGMA synchronous=NORMAL')
+
+    if args.rollups:
+        from rollups import RollupEngine
+        started = time.monotonic()
+        folded = RollupEngine().backfill(days[0], days[-1])
+        print(f"rollups: {folded} user-days folded in {time.monotonic() - started:.1f}s")
+
+    # Fresh statistics, or the planner keeps treating the tables as near-empty
+    with get_db() as conn:
+        conn.execute('ANALYZE')
+
+if __name__ == '__main__':
+    main()
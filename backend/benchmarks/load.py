@@ -0,0 +1,163 @@
+"""End-to-end load generator for /api/text_ask and /api/transcribe
+
+    DB_PATH=benchmark.db python -m benchmarks.load --requests 5000 --concurrency 32
+    DB_PATH=benchmark.db python -m benchmarks.load --server asgi --endpoint transcribe
+    python -m benchmarks.load --url http://localhost:8000 --requests 20000
+
+Without --url the app is started in this process (the threaded Flask server,
+or asgi.py on uvicorn) with the stub TTS and speech backends. A server given
+with --url should be started with TTS_BACKEND=stub SPEECH_BACKEND=stub.
+Synthetic users are the bench_user<N> ids written by generate_data.
+"""
+import argparse
+import io
+import logging
+import math
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+# Offline backends: nothing here should reach Google's services
+os.environ.setdefault('TTS_BACKEND', 'stub')
+os.environ.setdefault('SPEECH_BACKEND', 'stub')
+os.environ.setdefault('TTS_PREWARM', '0')
+
+import requests
+
+ENDPOINTS = ('text_ask', 'transcribe')
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='base URL of a running server (default: start one in-process)')
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi', help='in-process server to start')
+    parser.add_argument('--endpoint', choices=ENDPOINTS + ('both',), default='both')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--users', type=int, default=10000, help='bench_user ids to spread requests over (0: anonymous)')
+    parser.add_argument('--audio-seconds', type=float, default=2.0, help='length of the WAV uploaded to transcribe')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-save', action='store_true')
+    return parser.parse_args(argv)
+
+def sine_wav(seconds, rate=16000, frequency=440.0):
+    """A mono 16-bit WAV tone, so uploads take the in-memory decode path"""
+    frames = b''.join(struct.pack('<h', int(8000 * math.sin(2 * math.pi * frequency * i / rate)))
+                      for i in range(int(seconds * rate)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(frames)
+    return buffer.getvalue()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(kind):
+    """Serve the app on a background thread and return its base URL"""
+    port = free_port()
+    if kind == 'asgi':
+        import uvicorn
+        import asgi
+        server = uvicorn.Server(uvicorn.Config(asgi.app, host='127.0.0.1', port=port, log_level='warning'))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+    else:
+        from werkzeug.serving import make_server
+        import app
+        # One access-log line per request would dominate the run
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        app.create_app()
+        app.start_background_services()
+        server = make_server('127.0.0.1', port, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+def build_plan(args, questions):
+    """(endpoint, form fields) for every request, fixed by the seed"""
+    rng = random.Random(args.seed)
+    endpoints = ENDPOINTS if args.endpoint == 'both' else (args.endpoint,)
+    plan = []
+    for _ in range(args.requests):
+        fields = {}
+        if args.users:
+            fields['user_id'] = f'bench_user{rng.randrange(args.users)}'
+        endpoint = rng.choice(endpoints)
+        if endpoint == 'text_ask':
+            fields['text'] = rng.choice(questions)
+        plan.append((endpoint, fields))
+    return plan
+
+def run_plan(base_url, plan, concurrency, audio):
+    """Send every planned request with concurrency client threads
+
+    Returns ({endpoint: [latency, ...]}, {endpoint: errors}, elapsed seconds).
+    """
+    latencies = {endpoint: [] for endpoint in ENDPOINTS}
+    errors = dict.fromkeys(ENDPOINTS, 0)
+    pending = iter(plan)
+    lock = threading.Lock()
+    local = threading.local()
+
+    def worker():
+        session = local.session = getattr(local, 'session', None) or requests.Session()
+        while True:
+            with lock:
+                request = next(pending, None)
+            if request is None:
+                return
+            endpoint, fields = request
+            files = {'audio': ('question.wav', audio, 'audio/wav')} if endpoint == 'transcribe' else None
+            started = time.perf_counter()
+            try:
+                response = session.post(f"{base_url}/api/{endpoint}", data=fields, files=files, timeout=60)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies[endpoint].append(elapsed)
+                if not ok:
+                    errors[endpoint] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return latencies, errors, time.perf_counter() - started
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    from benchmarks.corpus import question_corpus
+    from benchmarks.stats import summarize, save_results, print_table
+
+    base_url = args.url.rstrip('/') if args.url else start_server(args.server)
+    plan = build_plan(args, question_corpus(10000, seed=args.seed))
+    audio = sine_wav(args.audio_seconds)
+    # Warm connections, caches and recognizer workers before measuring
+    run_plan(base_url, plan[:args.concurrency * 2], args.concurrency, audio)
+
+    latencies, errors, elapsed = run_plan(base_url, plan, args.concurrency, audio)
+    results = {f'/api/{endpoint}': summarize(latencies[endpoint], elapsed, errors[endpoint])
+               for endpoint in ENDPOINTS if latencies[endpoint]}
+    results['all'] = summarize([value for values in latencies.values() for value in values], elapsed,
+                               sum(errors.values()))
+
+    print_table(results)
+    print(f"Errors: {sum(errors.values())} of {len(plan)} requests")
+    if not args.no_save:
+        params = vars(args) | {'target': args.url or f'in-process {args.server}'}
+        print(f"Saved {save_results('load', results, params)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Micro-benchmarks for intent matching and response building
+
+    DB_PATH=benchmark.db python -m benchmarks.micro --questions 100000 --users 1000
+
+Times match_intent, match_intent_enhanced and match_intents over the
+synthetic question corpus, then get_response for every intent with user ids
+sampled from the database (first calls per user miss the response cache,
+later ones hit it, as in production).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+# Offline backends: nothing here should reach Google's services
+os.environ.setdefault('TTS_BACKEND', 'stub')
+os.environ.setdefault('SPEECH_BACKEND', 'stub')
+os.environ.setdefault('TTS_PREWARM', '0')
+
+from db import DB_PATH, get_db
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=100000, help='size of the question corpus')
+    parser.add_argument('--calls', type=int, default=20000, help='get_response calls per intent')
+    parser.add_argument('--users', type=int, default=1000, help='distinct users sampled for get_response')
+    parser.add_argument('--batch-size', type=int, default=1000, help='questions per match_intents call')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-save', action='store_true')
+    return parser.parse_args(argv)
+
+def sample_users(count, seed):
+    with get_db() as conn:
+        user_ids = [row[0] for row in conn.execute('SELECT user_id FROM users')]
+    return random.Random(seed).sample(user_ids, min(count, len(user_ids))) or [None]
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    import app
+    from benchmarks.corpus import question_corpus
+    from benchmarks.stats import summarize, time_calls, save_results, print_table
+
+    app.create_app()
+    questions = question_corpus(args.questions, seed=args.seed)
+    results = {}
+
+    for name, matcher in (('match_intent', app.match_intent),
+                          ('match_intent_enhanced', app.match_intent_enhanced)):
+        latencies = time_calls(matcher, questions)
+        results[name] = summarize(latencies)
+
+    # Batch matching: latency is per batch, throughput counts questions
+    batches = [questions[start:start + args.batch_size] for start in range(0, len(questions), args.batch_size)]
+    started = time.perf_counter()
+    latencies = time_calls(app.match_intents, batches, warmup=1)
+    results['match_intents_batch'] = summarize(latencies, elapsed=time.perf_counter() - started)
+    results['match_intents_batch']['throughput_per_s'] = round(len(questions) / sum(latencies), 1)
+
+    rng = random.Random(args.seed)
+    user_ids = sample_users(args.users, args.seed)
+    with get_db() as conn:
+        intents = conn.execute('SELECT intent_id, name FROM Intent ORDER BY intent_id').fetchall()
+    for intent_id, intent_name in intents:
+        callers = [rng.choice(user_ids) for _ in range(args.calls)]
+        app.response_cache.invalidate_all()
+        latencies = time_calls(lambda user_id: app.get_response(intent_id, user_id), callers, warmup=0)
+        results[f'get_response:{intent_name}'] = summarize(latencies)
+
+    print_table(results)
+    if not args.no_save:
+        path = save_results('micro', results, vars(args) | {'db': DB_PATH})
+        print(f"Saved {path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Latency summaries and result files shared by the benchmark scripts"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def summarize(latencies, elapsed=None, errors=0):
+    """Latency percentiles (milliseconds) and throughput for one benchmark
+
+    latencies are in seconds; elapsed is the wall time of the whole run,
+    which for concurrent runs is shorter than the sum of the latencies.
+    """
+    values = sorted(latencies)
+    elapsed = sum(values) if elapsed is None else elapsed
+    to_ms = lambda value: round(value * 1000, 4) if value is not None else None
+    return {
+        'count': len(values),
+        'errors': errors,
+        'mean_ms': to_ms(sum(values) / len(values)) if values else None,
+        'p50_ms': to_ms(percentile(values, 50)),
+        'p95_ms': to_ms(percentile(values, 95)),
+        'p99_ms': to_ms(percentile(values, 99)),
+        'max_ms': to_ms(values[-1]) if values else None,
+        'throughput_per_s': round(len(values) / elapsed, 1) if elapsed else None,
+    }
+
+def time_calls(func, inputs, warmup=100):
+    """Call func(item) for every input, returning the latency of each call"""
+    for item in inputs[:warmup]:
+        func(item)
+    latencies = []
+    clock = time.perf_counter
+    for item in inputs:
+        started = clock()
+        func(item)
+        latencies.append(clock() - started)
+    return latencies
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_results(suite, results, params, output_dir=RESULTS_DIR):
+    """Write {benchmark: summary} plus run metadata to a timestamped JSON file"""
+    os.makedirs(output_dir, exist_ok=True)
+    started = datetime.now(timezone.utc)
+    document = {
+        'suite': suite,
+        'created_at': started.isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+    path = os.path.join(output_dir, f"{started.strftime('%Y%m%dT%H%M%SZ')}-{suite}.json")
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    return path
+
+def print_table(results):
+    print(f"{'benchmark':<40} {'count':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'per s':>10}")
+    for name, summary in results.items():
+        print(f"{name:<40} {summary['count']:>8} {summary['p50_ms'] or 0:>10.4f} {summary['p95_ms'] or 0:>10.4f} "
+              f"{summary['p99_ms'] or 0:>10.4f} {summary['throughput_per_s'] or 0:>10.1f}")
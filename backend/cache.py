@@ -0,0 +1,81 @@
+"""Read-through caches for data that get_response reads on every request"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds each data source may be served from memory before it is re-read
+DEFAULT_TTLS = {
+    'community': float(os.environ.get('CACHE_TTL_COMMUNITY', '60')),
+    # Per-user daily bundle: usage, impact and weekly cost fetched together
+    'user': float(os.environ.get('CACHE_TTL_USER', '30')),
+    'tips': float(os.environ.get('CACHE_TTL_TIPS', '300')),
+}
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))
+
+class TTLCache:
+    """Thread-safe LRU of loaded values that expire after a fixed TTL"""
+
+    def __init__(self, ttl, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expires_at, value), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss or expiry"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Load outside the lock; a concurrent miss may load twice, which is harmless
+        value = loader()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, match=None):
+        """Drop every entry, or only those whose key satisfies match(key)"""
+        with self._lock:
+            if match is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if match(key)]:
+                del self._entries[key]
+
+class ResponseDataCache:
+    """One TTLCache per data source so each can have its own freshness bound
+
+    Per-user sources are keyed by tuples starting with the user_id, which lets
+    write paths invalidate a single user without touching shared entries.
+    """
+
+    def __init__(self, ttls=None):
+        self.sources = {name: TTLCache(ttl) for name, ttl in (ttls or DEFAULT_TTLS).items()}
+
+    def get(self, source, key, loader):
+        return self.sources[source].get_or_load(key, loader)
+
+    def invalidate(self, source, match=None):
+        """Invalidate a whole source, or the entries of it matching match(key)"""
+        self.sources[source].invalidate(match)
+
+    def invalidate_user(self, user_id, sources=('user',)):
+        """Drop cached per-user rows after that user's data was written"""
+        for source in sources:
+            self.sources[source].invalidate(lambda key: key[0] == user_id)
+
+    def invalidate_all(self):
+        for cache in self.sources.values():
+            cache.invalidate()
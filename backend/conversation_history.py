@@ -0,0 +1,171 @@
+"""Paged conversation history and tiered retention of old turns
+
+Recent turns live in the hot conversations table. The retention job moves
+turns older than CONVERSATION_RETENTION_DAYS, in batches, into
+conversations_archive: one row per user and day holding that day's turns as
+compressed JSON. The hot table and its indexes stay small however long the
+service runs, and history reads merge both tiers behind one cursor.
+"""
+import base64
+import json
+import os
+import sys
+import zlib
+
+from db import get_db
+
+# Turns younger than this stay in the hot conversations table
+CONVERSATION_RETENTION_DAYS = int(os.environ.get('CONVERSATION_RETENTION_DAYS', '90'))
+# Hot rows moved per archive transaction
+CONVERSATION_ARCHIVE_BATCH_SIZE = int(os.environ.get('CONVERSATION_ARCHIVE_BATCH_SIZE', '5000'))
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+# Fields of a turn, in the order archived turns are stored
+TURN_FIELDS = ('id', 'conversation_id', 'user_message', 'assistant_message', 'intent_matched', 'timestamp')
+
+# Newest first, strictly before the cursor: a range scan of idx_conversations_user_timestamp
+# (whose entries end with the rowid, so ties on timestamp are ordered by id)
+HOT_PAGE_SQL = '''
+    SELECT id, conversation_id, user_message, assistant_message, intent_matched, timestamp
+    FROM conversations
+    WHERE user_id = ? AND (timestamp, id) < (?, ?)
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+'''
+
+UPSERT_ARCHIVE_SQL = '''
+    INSERT INTO conversations_archive (user_id, day, turn_count, first_timestamp, last_timestamp, turns)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, day) DO UPDATE SET
+        turn_count = excluded.turn_count,
+        first_timestamp = excluded.first_timestamp,
+        last_timestamp = excluded.last_timestamp,
+        turns = excluded.turns
+'''
+
+# Sorts after every real (timestamp, id), so a missing cursor means "from the newest turn"
+END_CURSOR = ('9999-12-31 23:59:59', sys.maxsize)
+
+def encode_cursor(turn):
+    """Opaque cursor for the position just after turn"""
+    raw = f"{turn['timestamp']}|{turn['id']}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """(timestamp, id) of a cursor; raises ValueError for anything we didn't issue"""
+    if not cursor:
+        return END_CURSOR
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, turn_id = raw.rsplit('|', 1)
+        return timestamp, int(turn_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+
+def pack_turns(turns):
+    return zlib.compress(json.dumps([[turn[field] for field in TURN_FIELDS] for turn in turns]).encode('utf-8'))
+
+def unpack_turns(blob):
+    return [dict(zip(TURN_FIELDS, values)) for values in json.loads(zlib.decompress(blob))]
+
+def _sort_key(turn):
+    return turn['timestamp'], turn['id']
+
+def fetch_history_page(user_id, limit=HISTORY_PAGE_SIZE, cursor=None):
+    """One page of a user's turns, newest first: (turns, next_cursor or None)
+
+    Keyset pagination: each page costs the same however deep the client has
+    paged, because both tiers are searched from the cursor position.
+    """
+    position = decode_cursor(cursor)
+    archive_key = user_id or ''
+    with get_db() as conn:
+        turns = [dict(zip(TURN_FIELDS, row))
+                 for row in conn.execute(HOT_PAGE_SQL, (user_id, position[0], position[1], limit + 1))]
+
+        # Whole archived days, newest first, until they cover the page
+        archived = []
+        rows = conn.execute('''
+            SELECT turns FROM conversations_archive
+            WHERE user_id = ? AND day <= substr(?, 1, 10)
+            ORDER BY day DESC
+        ''', (archive_key, position[0]))
+        for (blob,) in rows:
+            archived.extend(turn for turn in unpack_turns(blob) if _sort_key(turn) < position)
+            if len(archived) > limit:
+                break
+
+    turns = sorted(turns + archived, key=_sort_key, reverse=True)
+    page = turns[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(turns) > limit else None
+    return page, next_cursor
+
+class ConversationArchiver:
+    """Moves hot conversation rows older than a cutoff into conversations_archive in batches"""
+
+    def __init__(self, retention_days=CONVERSATION_RETENTION_DAYS, batch_size=CONVERSATION_ARCHIVE_BATCH_SIZE):
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+
+    def run(self, retention_days=None, max_batches=None):
+        """Archive every turn older than retention_days; returns a summary dict
+
+        Each batch commits on its own, so the job can be stopped and rerun at
+        any point and concurrent logging only waits for one batch at a time.
+        """
+        retention_days = self.retention_days if retention_days is None else retention_days
+        summary = {'archived': 0, 'batches': 0, 'archive_days': 0}
+        with get_db() as conn:
+            cutoff = conn.execute("SELECT datetime('now', ?)", (f'-{int(retention_days)} days',)).fetchone()[0]
+            summary['cutoff'] = cutoff
+            while max_batches is None or summary['batches'] < max_batches:
+                moved, days = self._archive_batch(conn, cutoff)
+                if not moved:
+                    break
+                summary['archived'] += moved
+                summary['archive_days'] += days
+                summary['batches'] += 1
+        return summary
+
+    def _archive_batch(self, conn, cutoff):
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute('''
+                SELECT user_id, id, conversation_id, user_message, assistant_message, intent_matched, timestamp
+                FROM conversations WHERE timestamp < ?
+                ORDER BY timestamp, id LIMIT ?
+            ''', (cutoff, self.batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                conn.rollback()
+                return 0, 0
+
+            by_day = {}
+            for user_id, *values in rows:
+                turn = dict(zip(TURN_FIELDS, values))
+                by_day.setdefault((user_id or '', turn['timestamp'][:10]), []).append(turn)
+
+            # Merge into days archived by earlier batches
+            upserts = []
+            for (user_id, day), turns in by_day.items():
+                cursor.execute('SELECT turns FROM conversations_archive WHERE user_id = ? AND day = ?', (user_id, day))
+                existing = cursor.fetchone()
+                if existing:
+                    turns = unpack_turns(existing[0]) + turns
+                turns.sort(key=_sort_key)
+                upserts.append((user_id, day, len(turns), turns[0]['timestamp'], turns[-1]['timestamp'],
+                                pack_turns(turns)))
+            cursor.executemany(UPSERT_ARCHIVE_SQL, upserts)
+            cursor.executemany('DELETE FROM conversations WHERE id = ?', [(row[1],) for row in rows])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(rows), len(by_day)
+
+if __name__ == '__main__':
+    # Cron entry point: python conversation_history.py [retention_days]
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else CONVERSATION_RETENTION_DAYS
+    print(json.dumps(ConversationArchiver().run(days)))
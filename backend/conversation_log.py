@@ -0,0 +1,177 @@
+"""Write-behind logging of conversation turns in batched transactions"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from db import get_db
+
+# 'async' batches inserts on a background thread; 'sync' commits each turn before responding
+CONVERSATION_LOG_MODE = os.environ.get('CONVERSATION_LOG_MODE', 'async')
+CONVERSATION_LOG_BATCH_SIZE = int(os.environ.get('CONVERSATION_LOG_BATCH_SIZE', '200'))
+# Longest a queued turn waits before its batch is flushed
+CONVERSATION_LOG_FLUSH_INTERVAL = float(os.environ.get('CONVERSATION_LOG_FLUSH_INTERVAL', '0.5'))
+CONVERSATION_LOG_QUEUE_SIZE = int(os.environ.get('CONVERSATION_LOG_QUEUE_SIZE', '10000'))
+# When the queue is full a request waits this long, then writes its own row (backpressure)
+CONVERSATION_LOG_ENQUEUE_TIMEOUT = float(os.environ.get('CONVERSATION_LOG_ENQUEUE_TIMEOUT', '1.0'))
+# Attempts for a write on the request path (sync mode, full queue) and during shutdown;
+# the background writer retries a locked database until it succeeds
+CONVERSATION_LOG_MAX_ATTEMPTS = int(os.environ.get('CONVERSATION_LOG_MAX_ATTEMPTS', '5'))
+CONVERSATION_LOG_RETRY_DELAY = 0.05
+CONVERSATION_LOG_MAX_RETRY_DELAY = 2.0
+
+INSERT_CONVERSATION_SQL = '''
+    INSERT INTO conversations (conversation_id, user_id, user_message, assistant_message, intent_matched)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+_STOP = object()
+
+# Primary result codes of a write that lost the lock to another connection and may succeed later
+RETRYABLE_SQLITE_CODES = (5, 6)  # SQLITE_BUSY, SQLITE_LOCKED
+
+def is_lock_error(error):
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in RETRYABLE_SQLITE_CODES
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+class ConversationLogger:
+    """Bounded queue of conversation rows flushed by count or time"""
+
+    def __init__(self, mode=CONVERSATION_LOG_MODE, batch_size=CONVERSATION_LOG_BATCH_SIZE,
+                 flush_interval=CONVERSATION_LOG_FLUSH_INTERVAL, queue_size=CONVERSATION_LOG_QUEUE_SIZE,
+                 enqueue_timeout=CONVERSATION_LOG_ENQUEUE_TIMEOUT):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._atexit_registered = False
+
+    @property
+    def is_async(self):
+        return self.mode == 'async'
+
+    def start(self):
+        """Start the flush thread (idempotent); rows are flushed on interpreter exit"""
+        if not self.is_async:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='conversation-log', daemon=True)
+                self._thread.start()
+                if not self._atexit_registered:
+                    atexit.register(self.stop)
+                    self._atexit_registered = True
+
+    def log(self, conversation_id, user_id, user_message, assistant_message, intent_matched):
+        """Record one conversation turn
+
+        Writes on the request path raise sqlite3.Error once their attempts are
+        used up, so a turn that could not be stored fails its request.
+        """
+        record = (conversation_id, user_id, user_message, assistant_message, intent_matched)
+        if not self.is_async or self._thread is None:
+            self._write([record], CONVERSATION_LOG_MAX_ATTEMPTS)
+            return
+        try:
+            self._queue.put(record, timeout=self.enqueue_timeout)
+        except queue.Full:
+            # The writer can't keep up; pay for this row on the request path instead of dropping it
+            print("Conversation log queue full, writing synchronously")
+            self._write([record], CONVERSATION_LOG_MAX_ATTEMPTS)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                return
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    record = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stop = True
+                    break
+                batch.append(record)
+            self._write_behind(batch)
+            if stop:
+                self._drain()
+                return
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not _STOP:
+                batch.append(record)
+        if batch:
+            self._write_behind(batch)
+
+    def _write(self, records, max_attempts=None):
+        """Insert records in one transaction, retrying a locked or busy database with backoff
+
+        Gives up (raising the last error) after max_attempts; None retries until
+        the write succeeds or the logger starts shutting down. Any other error
+        (missing table, read-only or failing disk) is raised at once.
+        """
+        delay = CONVERSATION_LOG_RETRY_DELAY
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with get_db() as conn:
+                    conn.executemany(INSERT_CONVERSATION_SQL, records)
+                    conn.commit()
+                return
+            except sqlite3.OperationalError as e:
+                limit = CONVERSATION_LOG_MAX_ATTEMPTS if self._stopping else max_attempts
+                if not is_lock_error(e) or (limit is not None and attempt >= limit):
+                    raise
+                print(f"Error writing {len(records)} conversation rows (attempt {attempt}, retrying): {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, CONVERSATION_LOG_MAX_RETRY_DELAY)
+
+    def _write_behind(self, records):
+        # Only rows that can never be written (or still can't at shutdown) are dropped
+        try:
+            self._write(records)
+        except Exception as e:
+            print(f"Error writing {len(records)} conversation rows, dropping them: {e}")
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        self._drain()
+
+    def stop(self, timeout=5.0):
+        """Flush remaining rows and stop the background thread"""
+        thread = self._thread
+        self._stopping = True
+        if thread is None or not thread.is_alive():
+            self._drain()
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            print(f"Conversation log writer did not drain its queue within {timeout}s; stopping without it")
+            return
+        thread.join(timeout)
+        self._thread = None
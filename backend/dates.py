@@ -0,0 +1,54 @@
+"""Calendar helpers: resolving "today" in a user's time zone and validating date ranges"""
+import os
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Time zone for users without one and for community-wide dates
+DEFAULT_TIMEZONE = os.environ.get('DEFAULT_TIMEZONE', 'UTC')
+# Pin "today" to a YYYY-MM-DD date, e.g. 2025-01-23 to demo against the bundled sample data
+PINNED_TODAY = os.environ.get('ECO_WHISPER_TODAY')
+# Longest span a range query may cover
+USAGE_RANGE_MAX_DAYS = int(os.environ.get('USAGE_RANGE_MAX_DAYS', '366'))
+# Span returned when a range request gives no start date
+USAGE_RANGE_DEFAULT_DAYS = 30
+
+@lru_cache(maxsize=256)
+def get_zone(name=None):
+    """ZoneInfo for an IANA name, falling back to DEFAULT_TIMEZONE and then UTC"""
+    for candidate in (name, DEFAULT_TIMEZONE):
+        if not candidate:
+            continue
+        try:
+            return ZoneInfo(candidate)
+        except (ZoneInfoNotFoundError, ValueError):
+            print(f"Unknown time zone '{candidate}'")
+    return timezone.utc
+
+def local_today(tz_name=None):
+    """Today's date (YYYY-MM-DD) in the given time zone"""
+    if PINNED_TODAY:
+        return PINNED_TODAY
+    return datetime.now(get_zone(tz_name)).date().isoformat()
+
+def previous_day(day):
+    return (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+
+def parse_date_range(start, end, today, max_days=USAGE_RANGE_MAX_DAYS, names=('start', 'end')):
+    """Validate optional start/end query values into an inclusive (start, end) pair
+
+    end defaults to today and start to USAGE_RANGE_DEFAULT_DAYS before end;
+    max_days=None allows any span. Raises ValueError with a message suitable
+    for the client, naming the fields as names.
+    """
+    start_name, end_name = names
+    try:
+        end_day = date.fromisoformat(end or today)
+        start_day = date.fromisoformat(start) if start else end_day - timedelta(days=USAGE_RANGE_DEFAULT_DAYS - 1)
+    except (TypeError, ValueError):
+        raise ValueError(f'{start_name} and {end_name} must be YYYY-MM-DD dates')
+    if start_day > end_day:
+        raise ValueError(f'{start_name} must not be after {end_name}')
+    if max_days is not None and (end_day - start_day).days + 1 > max_days:
+        raise ValueError(f'range may span at most {max_days} days')
+    return start_day.isoformat(), end_day.isoformat()
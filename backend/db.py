@@ -0,0 +1,87 @@
+"""SQLite connection management shared by all request handlers"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = os.environ.get('DB_PATH', 'eco_whisper_demo.db')
+# Idle connections kept per process; extra connections are opened on demand and closed on release
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000'))
+
+class ConnectionPool:
+    """Pool of long-lived SQLite connections configured for concurrent access"""
+
+    def __init__(self, path=DB_PATH, max_idle=DB_POOL_SIZE, busy_timeout_ms=DB_BUSY_TIMEOUT_MS):
+        self.path = path
+        self.max_idle = max_idle
+        self.busy_timeout_ms = busy_timeout_ms
+        # LIFO so the most recently used (warm) connection is handed out first
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        # Connections inherited across fork(); kept referenced so they are never finalized here
+        self._inherited = []
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        return conn
+
+    def _check_fork(self):
+        # Connections must not be shared with a forked child; start a fresh pool there.
+        # Closing the parent's handles in the child could checkpoint or remove its WAL file,
+        # so they are leaked instead (the parent should call close_all() before forking).
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._inherited.append(self._idle)
+                    self._idle = queue.LifoQueue(maxsize=self.max_idle)
+                    self._pid = os.getpid()
+
+    def acquire(self):
+        """Take an idle connection, or open a new one if none is available"""
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back anything left uncommitted"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that borrows a connection and always gives it back"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle connection (used on shutdown)"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+pool = ConnectionPool()
+
+def get_db():
+    """Borrow a pooled connection: `with get_db() as conn: ...`"""
+    return pool.connection()
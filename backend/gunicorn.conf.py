@@ -0,0 +1,31 @@
+"""Gunicorn settings for production serving, tuned through environment variables"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# One process per core by default; WEB_CONCURRENCY is the conventional override
+workers = int(os.environ.get('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+# Threads per worker overlap requests that wait on TTS, speech recognition or SQLite.
+# For the asyncio voice path serve asgi:app with uvicorn.workers.UvicornWorker instead.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+# Speech and TTS requests can take a while, especially on a cold start
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+# Recycle workers now and then to bound memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+# Run database setup once in the master, then share the loaded app with every worker
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+def post_fork(server, worker):
+    # Threads started in the master don't survive fork; start this worker's own
+    from app import start_background_services
+    start_background_services()
@@ -0,0 +1,170 @@
+"""Bulk ingestion of smart-meter readings into appliance_usage and daily Electricity_Usage"""
+import csv
+import json
+import os
+from datetime import datetime
+
+from db import get_db
+
+# Readings inserted per transaction
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '5000'))
+# Rejected rows reported back in detail; the rest are only counted
+INGEST_MAX_REPORTED_ERRORS = 20
+
+# Idempotent on retries thanks to idx_appliance_usage_reading_unique
+INSERT_READING_SQL = '''
+    INSERT OR IGNORE INTO appliance_usage (meter_id, appliance_name, start_time, end_time, kwh_consumed,
+                                           estimated_cost, peak_kwh)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Recompute a user's day from its readings, so replays converge on the same totals
+UPSERT_DAILY_USAGE_SQL = '''
+    INSERT INTO Electricity_Usage (usage_id, user_id, date, kwh_used, estimated_cost, is_peak_time)
+    SELECT
+        'meter_' || :user_id || '_' || :day,
+        :user_id,
+        :day,
+        ROUND(SUM(a.kwh_consumed), 3),
+        ROUND(SUM(a.estimated_cost), 2),
+        COALESCE(SUM(a.peak_kwh) * 2 > SUM(a.kwh_consumed), 0)
+    FROM appliance_usage a
+    WHERE a.meter_id IN (SELECT meter_id FROM smart_meters WHERE user_id = :user_id)
+      AND a.start_time >= :day AND a.start_time < date(:day, '+1 day')
+    HAVING COUNT(*) > 0
+    ON CONFLICT(user_id, date) DO UPDATE SET
+        kwh_used = excluded.kwh_used,
+        estimated_cost = excluded.estimated_cost,
+        is_peak_time = excluded.is_peak_time
+'''
+
+class ReadingError(ValueError):
+    """A reading that cannot be ingested"""
+
+def normalize_timestamp(value):
+    """Parse an ISO-8601 timestamp into SQLite's 'YYYY-MM-DD HH:MM:SS' (naive, as stored)"""
+    if value in (None, ''):
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ReadingError(f"invalid timestamp: {value!r}")
+    return parsed.replace(tzinfo=None).strftime('%Y-%m-%d %H:%M:%S')
+
+def parse_reading(record):
+    """Validate one reading dict and return the appliance_usage row tuple"""
+    if not isinstance(record, dict):
+        raise ReadingError('reading must be an object')
+    meter_id = record.get('meter_id')
+    appliance_name = record.get('appliance_name')
+    if not meter_id or not appliance_name:
+        raise ReadingError('meter_id and appliance_name are required')
+    start_time = normalize_timestamp(record.get('start_time'))
+    if start_time is None:
+        raise ReadingError('start_time is required')
+    end_time = normalize_timestamp(record.get('end_time'))
+    try:
+        kwh = float(record.get('kwh_consumed'))
+    except (TypeError, ValueError):
+        raise ReadingError(f"invalid kwh_consumed: {record.get('kwh_consumed')!r}")
+    if kwh < 0:
+        raise ReadingError('kwh_consumed must not be negative')
+    return (str(meter_id), str(appliance_name), start_time, end_time, kwh)
+
+def iter_ndjson(lines):
+    """Yield (line_number, record) from NDJSON text lines"""
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, ReadingError(f"invalid JSON: {e}")
+
+def iter_csv(lines):
+    """Yield (line_number, record) from CSV text lines with a header row"""
+    reader = csv.DictReader(lines)
+    for record in reader:
+        yield reader.line_num, record
+
+class MeterReadingIngestor:
+    """Streams readings into the database in batched transactions"""
+
+    def __init__(self, batch_size=INGEST_BATCH_SIZE, rollups=None, tariffs=None):
+        self.batch_size = batch_size
+        # Optional RollupEngine kept in step with the daily usage rows
+        self.rollups = rollups
+        # Optional TariffEngine that prices each reading as it is stored
+        self.tariffs = tariffs
+
+    def ingest(self, records):
+        """Ingest (line_number, record) pairs and return a summary dict
+
+        Each batch commits on its own, so a failed upload can simply be
+        retried: readings already stored are ignored and the daily totals
+        are recomputed from appliance_usage.
+        """
+        summary = {'received': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0,
+                   'unknown_meters': 0, 'errors': []}
+        user_days = set()
+        batch = []
+        for line_number, record in records:
+            summary['received'] += 1
+            try:
+                if isinstance(record, ReadingError):
+                    raise record
+                batch.append(parse_reading(record))
+            except ReadingError as e:
+                summary['rejected'] += 1
+                if len(summary['errors']) < INGEST_MAX_REPORTED_ERRORS:
+                    summary['errors'].append({'line': line_number, 'error': str(e)})
+            if len(batch) >= self.batch_size:
+                user_days |= self._write_batch(batch, summary)
+                batch = []
+        if batch:
+            user_days |= self._write_batch(batch, summary)
+        summary['days_updated'] = len(user_days)
+        summary['users_updated'] = sorted({user_id for user_id, _ in user_days})
+        return summary
+
+    def _write_batch(self, rows, summary):
+        with get_db() as conn:
+            cursor = conn.cursor()
+            # Map the batch's meters to their owners (None for registered meters without one)
+            meter_ids = sorted({row[0] for row in rows})
+            owners = {}
+            for start in range(0, len(meter_ids), 500):
+                chunk = meter_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(
+                    f"SELECT meter_id, user_id FROM smart_meters WHERE meter_id IN ({placeholders})", chunk)
+                owners.update(cursor.fetchall())
+
+            # Readings from unregistered meters could never roll up to a user, so they aren't stored
+            known = [row for row in rows if row[0] in owners]
+            summary['unknown_meters'] += len(rows) - len(known)
+            if not known:
+                return set()
+            if self.tariffs is not None:
+                known = self.tariffs.price_rows(known)
+            else:
+                known = [row + (None, None) for row in known]
+            cursor.executemany(INSERT_READING_SQL, known)
+            inserted = max(cursor.rowcount, 0)
+            summary['inserted'] += inserted
+            summary['duplicates'] += len(known) - inserted
+
+            user_days = {(owners[meter_id], start_time[:10])
+                         for meter_id, _, start_time, *_ in known if owners[meter_id]}
+
+            if self.rollups is not None:
+                before = self.rollups.snapshot(cursor, user_days)
+                self.rollups.seed(cursor, {day for _, day in user_days})
+            cursor.executemany(UPSERT_DAILY_USAGE_SQL, [{'user_id': u, 'day': d} for u, d in sorted(user_days)])
+            if self.rollups is not None:
+                after = self.rollups.snapshot(cursor, user_days)
+                self.rollups.apply(cursor, [(user_id, day, before.get((user_id, day)), kwh)
+                                            for (user_id, day), kwh in after.items()])
+            conn.commit()
+        return user_days
@@ -0,0 +1,228 @@
+"""In-process counters, latency histograms and stage spans, rendered in Prometheus text format
+
+Each serving process keeps its own registry, so with several gunicorn
+workers a scrape of /metrics sees the worker that answered it; scrape every
+worker (or run one worker per container) for complete numbers.
+"""
+import cProfile
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Set METRICS_ENABLED=0 to turn every span and counter into a no-op
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+# Share of requests run under cProfile; their profile is kept only if they turn out slow
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', '1.0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# Newest slow-request profiles kept on disk
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '50'))
+
+# Seconds; spans range from sub-millisecond cache hits to multi-second speech recognition
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic count per label combination"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label combination"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (+Inf last), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(float(bound))
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+class GaugeCallback:
+    """Gauge read at scrape time from callback() -> {label values tuple: value}"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, callback, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+class MetricsRegistry:
+    """Named metrics of one process, rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge_callback(self, name, help_text, callback, labelnames=()):
+        return self._register(GaugeCallback(name, help_text, callback, labelnames))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    'eco_whisper_stage_seconds', 'Time spent in each stage of answering a request', ('stage',))
+db_query_seconds = registry.histogram(
+    'eco_whisper_db_query_seconds', 'SQLite queries issued while building answers', ('query',))
+request_seconds = registry.histogram(
+    'eco_whisper_request_seconds', 'HTTP request latency', ('endpoint', 'method', 'status'))
+intent_matches = registry.counter(
+    'eco_whisper_intent_matches_total',
+    'Matched intents by matcher: index (Intent patterns), rules (keyword fallback) or default (general_eco)',
+    ('intent', 'matcher'))
+profiles_saved = registry.counter(
+    'eco_whisper_slow_request_profiles_total', 'Sampled slow requests whose cProfile output was saved', ('endpoint',))
+
+# Stages of the request being handled, for the slow-request log
+_current_stages = ContextVar('current_stages', default=None)
+
+@contextmanager
+def span(stage, histogram=stage_seconds, label='stage'):
+    """Time a block into histogram{label=stage} and the current request's stage list"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, **{label: stage})
+        stages = _current_stages.get()
+        if stages is not None:
+            stages.append((stage, elapsed))
+
+def db_span(query):
+    """span() for a named database query"""
+    return span(query, db_query_seconds, 'query')
+
+def count_intent(intent, matcher):
+    if METRICS_ENABLED:
+        intent_matches.inc(intent=intent, matcher=matcher)
+
+class RequestTimer:
+    """Per-request timing started before and finished after the handler
+
+    A PROFILE_SAMPLE_RATE share of requests also runs under cProfile; when
+    such a request takes PROFILE_SLOW_SECONDS or more its profile is written
+    to PROFILE_DIR and its stage breakdown is printed.
+    """
+
+    def __init__(self, profile=True):
+        self.started = time.perf_counter()
+        self.stages = []
+        self._token = _current_stages.set(self.stages)
+        self.profiler = None
+        if profile and PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def finish(self, endpoint, method, status):
+        elapsed = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.profiler.disable()
+        _current_stages.reset(self._token)
+        request_seconds.observe(elapsed, endpoint=endpoint, method=method, status=str(status))
+        if self.profiler is not None and elapsed >= PROFILE_SLOW_SECONDS:
+            self._save_profile(endpoint, elapsed)
+        return elapsed
+
+    def _save_profile(self, endpoint, elapsed):
+        breakdown = ', '.join(f"{stage}={duration * 1000:.1f}ms" for stage, duration in self.stages)
+        print(f"Slow request {endpoint} took {elapsed:.2f}s: {breakdown}")
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            name = f"{time.strftime('%Y%m%dT%H%M%S')}-{endpoint.replace('/', '_')}-{int(elapsed * 1000)}ms.prof"
+            self.profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+            profiles = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith('.prof'))
+            for old in profiles[:-PROFILE_MAX_FILES]:
+                os.remove(os.path.join(PROFILE_DIR, old))
+        except OSError as e:
+            print(f"Error saving profile: {e}")
+            return
+        profiles_saved.inc(endpoint=endpoint)
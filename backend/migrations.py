@@ -0,0 +1,193 @@
+"""Versioned schema migrations and optional sample data
+
+Run once per deployment, before starting the server:
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --seed     # ...and load sample_data.sql
+    python migrations.py --status   # print the current and latest versions
+
+Serving processes only compare the recorded version with the latest one
+(check_schema_version) and refuse to start on an outdated database.
+"""
+import os
+import sqlite3
+import sys
+
+from db import get_db
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+SAMPLE_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_data.sql')
+
+# Columns added after the first databases were created: (table, column, declaration).
+# SQLite can't add a column with a CURRENT_TIMESTAMP default, so timestamps are
+# added bare and backfilled.
+LEGACY_COLUMNS = [
+    ('conversations', 'user_id', 'TEXT'),
+    ('conversations', 'intent_matched', 'TEXT'),
+    ('Intent', 'question_patterns', 'TEXT'),
+    ('users', 'community_id', "TEXT DEFAULT 'community1'"),
+    ('users', 'timezone', 'TEXT'),
+    ('smart_meters', 'user_id', 'TEXT'),
+    ('appliance_usage', 'estimated_cost', 'REAL'),
+    ('appliance_usage', 'peak_kwh', 'REAL'),
+    ('appliance_usage', 'created_at', 'DATETIME'),
+    ('Tip', 'is_active', 'BOOLEAN DEFAULT 1'),
+    ('Tip', 'created_at', 'DATETIME'),
+    ('electricity_rates', 'is_active', 'BOOLEAN DEFAULT 1'),
+    ('Electricity_Usage', 'created_at', 'DATETIME'),
+    ('Community_Stats', 'created_at', 'DATETIME'),
+    ('Impact_Record', 'created_at', 'DATETIME'),
+]
+
+class SchemaVersionError(RuntimeError):
+    """The database is behind (or ahead of) the migrations this code expects"""
+
+def iter_statements(script):
+    """Split an SQL script into complete statements (trigger bodies stay whole)"""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        if not statement and (not line.strip() or line.lstrip().startswith('--')):
+            continue
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ''
+    if statement.strip():
+        yield statement.strip()
+
+def run_script(cursor, path):
+    """Execute an SQL file inside the caller's transaction (executescript would commit)"""
+    with open(path, 'r') as f:
+        for statement in iter_statements(f.read()):
+            cursor.execute(statement)
+
+def table_columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [column[1] for column in cursor.fetchall()]
+
+def add_legacy_columns(cursor):
+    for table, column, declaration in LEGACY_COLUMNS:
+        columns = table_columns(cursor, table)
+        if columns and column not in columns:
+            print(f"Adding {table}.{column}")
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+            if column == 'created_at':
+                cursor.execute(f"UPDATE {table} SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+
+def apply_baseline_schema(cursor):
+    run_script(cursor, SCHEMA_PATH)
+
+def dedupe_electricity_rates(cursor):
+    # Replaying sample_data.sql on every boot appended the same rates again and again
+    cursor.execute('''
+        DELETE FROM electricity_rates WHERE id NOT IN (
+            SELECT MAX(id) FROM electricity_rates
+            GROUP BY rate_type, effective_date, COALESCE(start_time, ''), COALESCE(end_time, '')
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_electricity_rates_window
+        ON electricity_rates(rate_type, effective_date, COALESCE(start_time, ''), COALESCE(end_time, ''))
+    ''')
+
+def create_conversation_archive(cursor):
+    # Turns moved out of conversations by the retention job: one row per user-day,
+    # turns stored as zlib-compressed JSON (see conversation_history.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversations_archive (
+            user_id TEXT NOT NULL,
+            day DATE NOT NULL,
+            turn_count INTEGER NOT NULL,
+            first_timestamp DATETIME NOT NULL,
+            last_timestamp DATETIME NOT NULL,
+            turns BLOB NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    # Lets the retention job find the oldest hot rows without scanning the table
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations(timestamp)')
+
+# Append new migrations here; never edit or reorder applied ones
+MIGRATIONS = [
+    (1, 'Add columns missing from databases created before migrations', add_legacy_columns),
+    (2, 'Create tables, triggers and indexes from schema.sql', apply_baseline_schema),
+    (3, 'Deduplicate electricity_rates', dedupe_electricity_rates),
+    (4, 'Add the conversation archive for tiered retention', create_conversation_archive),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def ensure_version_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def current_version(cursor):
+    """Highest applied migration, 0 for a database that predates migrations"""
+    try:
+        cursor.execute('SELECT MAX(version) FROM schema_version')
+    except sqlite3.OperationalError:
+        return 0
+    return cursor.fetchone()[0] or 0
+
+def migrate(seed=False):
+    """Apply pending migrations, each in its own transaction; returns the new version"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        ensure_version_table(cursor)
+        conn.commit()
+        for version, description, apply in MIGRATIONS:
+            # IMMEDIATE takes the write lock up front, so concurrent runs apply each step once
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                if version <= current_version(cursor):
+                    conn.rollback()
+                    continue
+                print(f"Applying migration {version}: {description}")
+                apply(cursor)
+                cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                               (version, description))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        if seed:
+            seed_sample_data(conn)
+        return current_version(cursor)
+
+def seed_sample_data(conn):
+    """Load sample_data.sql (idempotent: rows are replaced, not duplicated)"""
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        run_script(cursor, SAMPLE_DATA_PATH)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print("Loaded sample data")
+
+def check_schema_version():
+    """Fast startup check: raise SchemaVersionError unless the database is fully migrated"""
+    with get_db() as conn:
+        version = current_version(conn.cursor())
+    if version != LATEST_VERSION:
+        raise SchemaVersionError(
+            f"Database schema is at version {version}, this code expects {LATEST_VERSION}; "
+            f"run 'python migrations.py' first")
+    return version
+
+if __name__ == '__main__':
+    if '--status' in sys.argv:
+        with get_db() as conn:
+            print(f"Schema version {current_version(conn.cursor())} (latest {LATEST_VERSION})")
+        sys.exit(0)
+    try:
+        version = migrate(seed='--seed' in sys.argv)
+    except sqlite3.Error as e:
+        print(f"Migration failed: {e}")
+        sys.exit(1)
+    print(f"Database is at schema version {version}")
@@ -0,0 +1,170 @@
+"""Incremental daily rollups of Electricity_Usage into Community_Stats and Impact_Record"""
+import os
+from datetime import date, timedelta
+
+from db import get_db
+
+# Grid carbon intensity used to turn saved kWh into CO2
+CO2_KG_PER_KWH = float(os.environ.get('CO2_KG_PER_KWH', '0.25'))
+# Water consumed (mostly power-plant cooling) per kWh generated
+WATER_LITERS_PER_KWH = float(os.environ.get('WATER_LITERS_PER_KWH', '2.0'))
+# Daily consumption that savings are measured against
+BASELINE_KWH_PER_DAY = float(os.environ.get('BASELINE_KWH_PER_DAY', '8.0'))
+# Community for users that have not been assigned one
+DEFAULT_COMMUNITY_ID = os.environ.get('DEFAULT_COMMUNITY_ID', 'community1')
+
+# Conversion factors for the "equivalent to ..." phrases
+KG_CO2_PER_TREE = 21.0
+LITERS_PER_SHOWER = 15.0
+
+UPSERT_COMMUNITY_ROLLUP_SQL = '''
+    INSERT INTO Community_Rollup (community_id, date, total_kwh, user_count, total_co2_saved)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(community_id, date) DO UPDATE SET
+        total_kwh = total_kwh + excluded.total_kwh,
+        user_count = user_count + excluded.user_count,
+        total_co2_saved = total_co2_saved + excluded.total_co2_saved
+'''
+
+# Seeds a date's running sums from rows written before the rollup existed
+SEED_COMMUNITY_ROLLUP_SQL = '''
+    INSERT OR IGNORE INTO Community_Rollup (community_id, date, total_kwh, user_count, total_co2_saved)
+    SELECT COALESCE(u.community_id, :community), e.date, SUM(e.kwh_used), COUNT(*),
+           SUM(MAX(:baseline - e.kwh_used, 0) * :co2_factor)
+    FROM Electricity_Usage e LEFT JOIN users u ON u.user_id = e.user_id
+    WHERE e.date = :day
+    GROUP BY COALESCE(u.community_id, :community), e.date
+'''
+
+PUBLISH_COMMUNITY_STATS_SQL = '''
+    INSERT INTO Community_Stats (stat_id, community_id, date, avg_kwh_per_user, total_co2_saved)
+    SELECT 'rollup_' || community_id || '_' || date, community_id, date,
+           ROUND(total_kwh / user_count, 2), ROUND(total_co2_saved, 2)
+    FROM Community_Rollup
+    WHERE community_id = ? AND date = ? AND user_count > 0
+    ON CONFLICT(community_id, date) DO UPDATE SET
+        avg_kwh_per_user = excluded.avg_kwh_per_user,
+        total_co2_saved = excluded.total_co2_saved
+'''
+
+UPSERT_IMPACT_SQL = '''
+    INSERT INTO Impact_Record (impact_id, user_id, date, impact_value, impact_unit, impact_equivalent, impact_type)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, date, impact_type) DO UPDATE SET
+        impact_value = excluded.impact_value,
+        impact_unit = excluded.impact_unit,
+        impact_equivalent = excluded.impact_equivalent
+'''
+
+def daily_savings(kwh):
+    """(co2_kg, water_liters) saved by using kwh instead of the daily baseline"""
+    saved_kwh = max(BASELINE_KWH_PER_DAY - kwh, 0.0)
+    return saved_kwh * CO2_KG_PER_KWH, saved_kwh * WATER_LITERS_PER_KWH
+
+def impact_rows(user_id, day, kwh):
+    """Impact_Record rows for one user-day"""
+    co2, water = daily_savings(kwh)
+    return [
+        (f'rollup_{user_id}_{day}_co2', user_id, day, round(co2, 2), 'kg',
+         f'equivalent to planting {round(co2 / KG_CO2_PER_TREE, 2)} trees', 'CO2_saved'),
+        (f'rollup_{user_id}_{day}_water', user_id, day, round(water, 1), 'liters',
+         f'equivalent to {round(water / LITERS_PER_SHOWER, 1)} showers', 'water_saved'),
+    ]
+
+class RollupEngine:
+    """Maintains per-community daily sums and counts from per-user usage changes
+
+    Writers report each changed user-day as (user_id, day, old_kwh, new_kwh);
+    the engine applies the difference to the running sums, so keeping
+    Community_Stats and Impact_Record current costs the same per change no
+    matter how many rows the day already has.
+    """
+
+    def __init__(self, default_community=DEFAULT_COMMUNITY_ID):
+        self.default_community = default_community
+
+    def snapshot(self, cursor, user_days):
+        """Current kwh_used for each (user_id, day) that has a usage row"""
+        user_days = list(user_days)
+        usage = {}
+        for start in range(0, len(user_days), 400):
+            chunk = user_days[start:start + 400]
+            values = ','.join(['(?, ?)'] * len(chunk))
+            params = [value for pair in chunk for value in pair]
+            cursor.execute(f'''
+                SELECT user_id, date, kwh_used FROM Electricity_Usage
+                WHERE (user_id, date) IN (VALUES {values})
+            ''', params)
+            usage.update(((user_id, day), kwh) for user_id, day, kwh in cursor.fetchall())
+        return usage
+
+    def seed(self, cursor, days):
+        """Start running sums for dates that have none yet; call before changing their usage"""
+        for day in sorted(set(days)):
+            cursor.execute('SELECT 1 FROM Community_Rollup WHERE date = ? LIMIT 1', (day,))
+            if cursor.fetchone() is None:
+                cursor.execute(SEED_COMMUNITY_ROLLUP_SQL, {
+                    'community': self.default_community, 'day': day,
+                    'baseline': BASELINE_KWH_PER_DAY, 'co2_factor': CO2_KG_PER_KWH,
+                })
+
+    def apply(self, cursor, changes):
+        """Fold (user_id, day, old_kwh, new_kwh) changes into the aggregates"""
+        changes = [change for change in changes if change[2] != change[3]]
+        if not changes:
+            return set()
+        communities = self._communities(cursor, {user_id for user_id, _, _, _ in changes})
+
+        deltas = {}
+        impacts = []
+        for user_id, day, old_kwh, new_kwh in changes:
+            key = (communities.get(user_id) or self.default_community, day)
+            total_kwh, user_count, total_co2 = deltas.get(key, (0.0, 0, 0.0))
+            new_co2 = daily_savings(new_kwh)[0]
+            if old_kwh is None:
+                deltas[key] = (total_kwh + new_kwh, user_count + 1, total_co2 + new_co2)
+            else:
+                old_co2 = daily_savings(old_kwh)[0]
+                deltas[key] = (total_kwh + new_kwh - old_kwh, user_count, total_co2 + new_co2 - old_co2)
+            impacts.extend(impact_rows(user_id, day, new_kwh))
+
+        cursor.executemany(UPSERT_COMMUNITY_ROLLUP_SQL, [key + delta for key, delta in deltas.items()])
+        cursor.executemany(PUBLISH_COMMUNITY_STATS_SQL, list(deltas))
+        cursor.executemany(UPSERT_IMPACT_SQL, impacts)
+        return set(deltas)
+
+    def _communities(self, cursor, user_ids):
+        user_ids = sorted(user_ids)
+        communities = {}
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'SELECT user_id, community_id FROM users WHERE user_id IN ({placeholders})', chunk)
+            communities.update(cursor.fetchall())
+        return communities
+
+    def backfill(self, start_date, end_date):
+        """Rebuild the aggregates for every date in [start_date, end_date] from Electricity_Usage
+
+        Each date is rebuilt and committed on its own. The date's Community_Stats
+        rows are replaced outright (a community left without usage loses its
+        row), and the Impact_Record rows of users with usage are overwritten,
+        so hand-entered values for those dates do not survive. Returns the
+        number of user-days folded in.
+        """
+        folded = 0
+        day = date.fromisoformat(start_date)
+        end = date.fromisoformat(end_date)
+        while day <= end:
+            iso_day = day.isoformat()
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM Community_Rollup WHERE date = ?', (iso_day,))
+                cursor.execute('DELETE FROM Community_Stats WHERE date = ?', (iso_day,))
+                cursor.execute('SELECT user_id, kwh_used FROM Electricity_Usage WHERE date = ?', (iso_day,))
+                changes = [(user_id, iso_day, None, kwh) for user_id, kwh in cursor.fetchall()]
+                self.apply(cursor, changes)
+                conn.commit()
+            folded += len(changes)
+            day += timedelta(days=1)
+        return folded
@@ -1,5 +1,6 @@
 -- Eco Whisper Demo Database Schema
--- This file contains all CREATE TABLE statements, indexes, and constraints
+-- This file contains all CREATE TABLE statements, indexes, and constraints.
+-- It is applied by migrations.py; later changes go in new migrations there.
 
 -- Users table for user management
 CREATE TABLE IF NOT EXISTS users (
@@ -7,7 +8,9 @@ CREATE TABLE IF NOT EXISTS users (
     username TEXT NOT NULL UNIQUE,
     email TEXT UNIQUE,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    is_active BOOLEAN DEFAULT 1
+    is_active BOOLEAN DEFAULT 1,
+    community_id TEXT DEFAULT 'community1',
+    timezone TEXT
 );
 
 -- Intent table for mapping user queries to responses
@@ -16,11 +19,43 @@ CREATE TABLE IF NOT EXISTS Intent (
     name TEXT NOT NULL,
     description TEXT,
     requires_data_access BOOLEAN DEFAULT 0,
-    response_template TEXT NOT NULL
+    response_template TEXT NOT NULL,
+    question_patterns TEXT
+);
+
+-- Intent version counter, bumped by triggers so the in-memory intent index
+-- only rebuilds when the Intent table actually changes
+CREATE TABLE IF NOT EXISTS Intent_Version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0
 );
 
--- Add question_patterns column if it doesn't exist
-ALTER TABLE Intent ADD COLUMN question_patterns TEXT;
+INSERT OR IGNORE INTO Intent_Version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_intent_version_insert AFTER INSERT ON Intent
+BEGIN
+    UPDATE Intent_Version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_intent_version_update AFTER UPDATE ON Intent
+BEGIN
+    UPDATE Intent_Version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_intent_version_delete AFTER DELETE ON Intent
+BEGIN
+    UPDATE Intent_Version SET version = version + 1 WHERE id = 1;
+END;
+
+-- Running daily sums behind Community_Stats, updated incrementally by rollups.py
+CREATE TABLE IF NOT EXISTS Community_Rollup (
+    community_id TEXT NOT NULL,
+    date DATE NOT NULL,
+    total_kwh REAL NOT NULL DEFAULT 0,
+    user_count INTEGER NOT NULL DEFAULT 0,
+    total_co2_saved REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (community_id, date)
+);
 
 -- Electricity usage tracking per user
 CREATE TABLE IF NOT EXISTS Electricity_Usage (
@@ -99,6 +134,8 @@ CREATE TABLE IF NOT EXISTS appliance_usage (
     start_time DATETIME NOT NULL,
     end_time DATETIME,
     kwh_consumed REAL NOT NULL,
+    estimated_cost REAL,
+    peak_kwh REAL,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (meter_id) REFERENCES smart_meters (meter_id)
 );
@@ -121,7 +158,13 @@ CREATE INDEX IF NOT EXISTS idx_impact_record_user_date ON Impact_Record(user_id,
 CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp ON conversations(user_id, timestamp);
 CREATE INDEX IF NOT EXISTS idx_appliance_usage_meter_time ON appliance_usage(meter_id, start_time);
 CREATE INDEX IF NOT EXISTS idx_electricity_rates_effective_date ON electricity_rates(effective_date);
+CREATE INDEX IF NOT EXISTS idx_electricity_usage_date ON Electricity_Usage(date);
+CREATE INDEX IF NOT EXISTS idx_electricity_usage_user_date_covering ON Electricity_Usage(user_id, date, kwh_used, estimated_cost, is_peak_time);
+CREATE INDEX IF NOT EXISTS idx_community_stats_range ON Community_Stats(community_id, date, avg_kwh_per_user, total_co2_saved);
 
 -- Create unique constraints
 CREATE UNIQUE INDEX IF NOT EXISTS idx_electricity_usage_user_date_unique ON Electricity_Usage(user_id, date);
-CREATE UNIQUE INDEX IF NOT EXISTS idx_community_stats_community_date ON Community_Stats(community_id, date); 
\ No newline at end of file
+CREATE UNIQUE INDEX IF NOT EXISTS idx_community_stats_community_date ON Community_Stats(community_id, date);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_impact_record_user_date_type ON Impact_Record(user_id, date, impact_type);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_appliance_usage_reading_unique ON appliance_usage(meter_id, appliance_name, start_time);
+CREATE INDEX IF NOT EXISTS idx_smart_meters_user ON smart_meters(user_id);
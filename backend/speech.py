@@ -0,0 +1,196 @@
+"""Speech recognition backends and the warm recognizer worker pool"""
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Which backend transcribes audio: 'google' (network), 'vosk' (offline model) or 'stub' (tests)
+SPEECH_BACKEND = os.environ.get('SPEECH_BACKEND', 'google')
+SPEECH_WORKERS = int(os.environ.get('SPEECH_WORKERS', str(os.cpu_count() or 2)))
+# Requests allowed to wait for a worker on top of the ones being processed
+SPEECH_QUEUE_SIZE = int(os.environ.get('SPEECH_QUEUE_SIZE', '16'))
+SPEECH_TIMEOUT = float(os.environ.get('SPEECH_TIMEOUT', '15'))
+VOSK_MODEL_PATH = os.environ.get('VOSK_MODEL_PATH', 'models/vosk')
+SPEECH_STUB_TRANSCRIPT = os.environ.get('SPEECH_STUB_TRANSCRIPT', 'how much electricity did I use today')
+
+class SpeechNotUnderstood(Exception):
+    """The audio contained no recognizable speech"""
+
+class SpeechServiceError(Exception):
+    """The recognizer failed, timed out or is overloaded"""
+
+class GoogleRecognizer:
+    """Google Web Speech API through SpeechRecognition (network round trip per request)"""
+    name = 'google'
+    # Network bound, so threads are enough
+    uses_processes = False
+
+    def __init__(self, timeout=SPEECH_TIMEOUT):
+        import speech_recognition as sr
+        self._sr = sr
+        self.timeout = timeout
+
+    def recognize(self, pcm, sample_rate, sample_width):
+        sr = self._sr
+        recognizer = sr.Recognizer()
+        recognizer.operation_timeout = self.timeout
+        try:
+            return recognizer.recognize_google(sr.AudioData(pcm, sample_rate, sample_width))
+        except sr.UnknownValueError:
+            raise SpeechNotUnderstood()
+        except sr.RequestError as e:
+            raise SpeechServiceError(str(e))
+
+class VoskRecognizer:
+    """Offline recognition with a local Vosk model, loaded once per worker process"""
+    name = 'vosk'
+    # CPU bound, so each worker is a process holding its own copy of the model
+    uses_processes = True
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        from vosk import Model, SetLogLevel
+        SetLogLevel(-1)
+        self.model = Model(model_path)
+
+    def recognize(self, pcm, sample_rate, sample_width):
+        from vosk import KaldiRecognizer
+        if sample_width != 2:
+            raise SpeechServiceError('Vosk needs 16-bit PCM')
+        recognizer = KaldiRecognizer(self.model, sample_rate)
+        recognizer.AcceptWaveform(pcm)
+        text = json.loads(recognizer.FinalResult()).get('text', '').strip()
+        if not text:
+            raise SpeechNotUnderstood()
+        return text
+
+class StubRecognizer:
+    """Returns a fixed transcript; for tests and offline development"""
+    name = 'stub'
+    uses_processes = False
+
+    def __init__(self, transcript=SPEECH_STUB_TRANSCRIPT):
+        self.transcript = transcript
+
+    def recognize(self, pcm, sample_rate, sample_width):
+        if not pcm:
+            raise SpeechNotUnderstood()
+        return self.transcript
+
+SPEECH_BACKENDS = {
+    'google': GoogleRecognizer,
+    'vosk': VoskRecognizer,
+    'stub': StubRecognizer,
+}
+
+def register_backend(name, backend_class):
+    """Make a custom recognizer selectable through SPEECH_BACKEND"""
+    SPEECH_BACKENDS[name] = backend_class
+
+# Per-process recognizer instance used by pool workers
+_worker_recognizer = None
+
+def _init_worker(backend_name):
+    global _worker_recognizer
+    _worker_recognizer = SPEECH_BACKENDS[backend_name]()
+
+def _recognize_in_worker(pcm, sample_rate, sample_width):
+    return _worker_recognizer.recognize(pcm, sample_rate, sample_width)
+
+class RecognizerPool:
+    """Bounded pool of warm recognizers with per-request timeouts"""
+
+    def __init__(self, backend_name=SPEECH_BACKEND, workers=SPEECH_WORKERS,
+                 queue_size=SPEECH_QUEUE_SIZE, timeout=SPEECH_TIMEOUT):
+        if backend_name not in SPEECH_BACKENDS:
+            print(f"Unknown speech backend '{backend_name}', falling back to google")
+            backend_name = 'google'
+        self.backend_name = backend_name
+        self.backend_class = SPEECH_BACKENDS[backend_name]
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Started lazily so models load in the serving process, not at import time
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    executor_class = ProcessPoolExecutor if self.backend_class.uses_processes else ThreadPoolExecutor
+                    self._executor = executor_class(
+                        max_workers=self.workers,
+                        initializer=_init_worker,
+                        initargs=(self.backend_name,),
+                    )
+        return self._executor
+
+    def warm_up(self):
+        """Start the workers (and load models) ahead of the first request"""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(len, b'')
+
+    def recognize(self, pcm, sample_rate, sample_width, timeout=None):
+        """Transcribe raw PCM, raising SpeechNotUnderstood or SpeechServiceError"""
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise SpeechServiceError('Speech recognition is overloaded')
+        try:
+            future = self._get_executor().submit(_recognize_in_worker, pcm, sample_rate, sample_width)
+        except Exception as e:
+            self._slots.release()
+            raise SpeechServiceError(str(e))
+        # The slot stays taken until the worker is really done, even if we stop waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise SpeechServiceError('Speech recognition timed out')
+        except (SpeechNotUnderstood, SpeechServiceError):
+            raise
+        except Exception as e:
+            raise SpeechServiceError(str(e))
+
+    async def recognize_async(self, pcm, sample_rate, sample_width, timeout=None):
+        """recognize() as an awaitable; the event loop is never blocked on the worker"""
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(blocking=False):
+            # Pool is saturated: wait for a slot on a helper thread rather than the loop
+            loop = asyncio.get_running_loop()
+            acquiring = loop.run_in_executor(None, self._slots.acquire, True, timeout)
+            try:
+                acquired = await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                # The helper thread may still get a slot after this task stops waiting; give it back
+                acquiring.add_done_callback(self._release_abandoned_slot)
+                raise
+            if not acquired:
+                raise SpeechServiceError('Speech recognition is overloaded')
+        try:
+            future = self._get_executor().submit(_recognize_in_worker, pcm, sample_rate, sample_width)
+        except Exception as e:
+            self._slots.release()
+            raise SpeechServiceError(str(e))
+        future.add_done_callback(lambda _: self._slots.release())
+        
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise SpeechServiceError('Speech recognition timed out')
+        except (SpeechNotUnderstood, SpeechServiceError):
+            raise
+        except Exception as e:
+            raise SpeechServiceError(str(e))
+
+    def _release_abandoned_slot(self, acquiring):
+        if not acquiring.cancelled() and acquiring.exception() is None and acquiring.result():
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
@@ -0,0 +1,281 @@
+"""Managed on-disk storage for synthesized audio and temporary upload files"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# All generated audio lives under this directory: tts/ for answer clips, tmp/ for uploads in flight
+AUDIO_STORAGE_DIR = os.environ.get('AUDIO_STORAGE_DIR', 'audio_storage')
+AUDIO_MAX_BYTES = int(os.environ.get('AUDIO_MAX_BYTES', str(200 * 1024 * 1024)))
+# Clips not requested for this long are deleted
+AUDIO_MAX_AGE = float(os.environ.get('AUDIO_MAX_AGE', str(7 * 24 * 3600)))
+# Temp files older than this belong to a request that died without cleaning up
+AUDIO_TEMP_TTL = float(os.environ.get('AUDIO_TEMP_TTL', '3600'))
+AUDIO_REAPER_INTERVAL = float(os.environ.get('AUDIO_REAPER_INTERVAL', '300'))
+# Directory entries handled per scan batch before yielding, to keep the reaper from hogging the disk
+AUDIO_REAPER_BATCH = 1000
+# A served clip's mtime is bumped at most this often, so every worker sees when it was last used
+AUDIO_TOUCH_INTERVAL = 60
+
+class AudioStorage:
+    """Content-addressed clip store with an in-memory LRU index and a background reaper
+
+    The directory is shared by every worker process, and the files are the
+    source of truth: a lookup missing from this process's index falls back to
+    a stat() of the clip (and adopts it), and a clip's last use is its mtime,
+    which lookups bump. Each reaper pass rescans the directory, so the size
+    limit and age eviction see every worker's clips. Startup never walks the
+    directory, however many files have piled up.
+    """
+
+    def __init__(self, directory=AUDIO_STORAGE_DIR, max_bytes=AUDIO_MAX_BYTES, max_age=AUDIO_MAX_AGE,
+                 temp_ttl=AUDIO_TEMP_TTL, reaper_interval=AUDIO_REAPER_INTERVAL, legacy_dirs=None):
+        self.root = os.path.abspath(directory)
+        self.directory = os.path.join(self.root, 'tts')
+        self.temp_directory = os.path.join(self.root, 'tmp')
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.temp_ttl = temp_ttl
+        self.reaper_interval = reaper_interval
+        # Older releases wrote answer_*.mp3 and temp_audio_* into the working directory
+        self.legacy_dirs = legacy_dirs if legacy_dirs is not None else [os.getcwd()]
+        # key -> (size, last_access), least recently used first
+        self._index = OrderedDict()
+        self._total_bytes = 0
+        # key -> when this process last bumped the clip's mtime
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._reaper = None
+        self._bootstrapped = False
+        self._directories_ready = False
+
+    def ensure_directories(self):
+        """Create the clip and temp directories (on first use, not at import time)"""
+        if not self._directories_ready:
+            os.makedirs(self.directory, exist_ok=True)
+            os.makedirs(self.temp_directory, exist_ok=True)
+            self._directories_ready = True
+
+    # -- clip index --------------------------------------------------------
+
+    @staticmethod
+    def filename_for(key):
+        return f"tts_{key}.mp3"
+
+    def path_for(self, key):
+        return os.path.join(self.directory, self.filename_for(key))
+
+    def get(self, key):
+        """Return the stored clip's path, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or now - entry[1] > self.max_age:
+                # Written or used by another worker since this process last looked
+                entry = self._stat_clip(key)
+            if entry is None:
+                return None
+            size, last_access = entry
+            if now - last_access > self.max_age:
+                self._remove(key)
+                return None
+            self._index[key] = (size, now)
+            self._index.move_to_end(key)
+            touch = now - self._touched.get(key, last_access) > AUDIO_TOUCH_INTERVAL
+            if touch:
+                self._touched[key] = now
+        if touch:
+            self._touch(key)
+        return self.path_for(key)
+
+    def add(self, key):
+        """Record a freshly written clip; the reaper enforces the size limit"""
+        try:
+            size = os.path.getsize(self.path_for(key))
+        except OSError:
+            return
+        with self._lock:
+            if key in self._index:
+                self._total_bytes -= self._index[key][0]
+            self._index[key] = (size, time.time())
+            self._index.move_to_end(key)
+            self._total_bytes += size
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self._wakeup.set()
+
+    def __contains__(self, key):
+        return key in self._index or os.path.exists(self.path_for(key))
+
+    @staticmethod
+    def _last_used(stat):
+        return max(stat.st_mtime, stat.st_atime)
+
+    def _stat_clip(self, key):
+        # Caller holds the lock; (re)index a clip from the file, dropping it if the file is gone
+        try:
+            stat = os.stat(self.path_for(key))
+        except OSError:
+            if key in self._index:
+                self._total_bytes -= self._index.pop(key)[0]
+            return None
+        previous = self._index.get(key)
+        entry = (stat.st_size, max(self._last_used(stat), previous[1] if previous else 0))
+        self._total_bytes += stat.st_size - (previous[0] if previous else 0)
+        self._index[key] = entry
+        return entry
+
+    def _touch(self, key):
+        try:
+            os.utime(self.path_for(key))
+        except OSError:
+            pass
+
+    def _remove(self, key):
+        # Caller holds the lock
+        size, _ = self._index.pop(key)
+        self._total_bytes -= size
+        self._touched.pop(key, None)
+        try:
+            os.remove(self.path_for(key))
+        except OSError:
+            pass
+
+    # -- temp files --------------------------------------------------------
+
+    def temp_path(self, suffix=''):
+        """Path for a request-scoped temp file; remove it with discard()"""
+        self.ensure_directories()
+        return os.path.join(self.temp_directory, f"temp_audio_{uuid.uuid4()}{suffix}")
+
+    def discard(self, *paths):
+        """Delete temp files, ignoring ones that were never created"""
+        for path in set(paths):
+            if not path:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # -- reaper ------------------------------------------------------------
+
+    def start_reaper(self):
+        """Start the background reaper thread (idempotent)"""
+        self.ensure_directories()
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reaper_loop, name='audio-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reaper_loop(self):
+        while True:
+            try:
+                self._scan()
+                self.reap()
+            except Exception as e:
+                print(f"Error in audio reaper: {e}")
+            self._wakeup.wait(self.reaper_interval)
+            self._wakeup.clear()
+
+    def _scan(self):
+        """Reconcile the index with the clips on disk (including other workers'), and clear out
+        leftover partial files; the first pass also sweeps legacy locations"""
+        self.ensure_directories()
+        now = time.time()
+        found = {}
+        with os.scandir(self.directory) as entries:
+            for i, entry in enumerate(entries):
+                name = entry.name
+                try:
+                    if name.startswith('tts_') and name.endswith('.mp3'):
+                        stat = entry.stat()
+                        found[name[len('tts_'):-len('.mp3')]] = (stat.st_size, self._last_used(stat))
+                    elif name.endswith('.part') and now - entry.stat().st_mtime > self.temp_ttl:
+                        # Leftover from a synthesis interrupted by a restart
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+                if i % AUDIO_REAPER_BATCH == AUDIO_REAPER_BATCH - 1:
+                    time.sleep(0)
+
+        with self._lock:
+            # Clips written after the scan started keep their entries
+            for key, (size, last_access) in self._index.items():
+                if key not in found and last_access >= now:
+                    found[key] = (size, last_access)
+            for key, (size, last_access) in found.items():
+                previous = self._index.get(key)
+                if previous and previous[1] > last_access:
+                    found[key] = (size, previous[1])
+            # Least recently used (by any worker) first
+            self._index = OrderedDict(sorted(found.items(), key=lambda item: item[1][1]))
+            self._touched = {key: touched for key, touched in self._touched.items() if key in self._index}
+            self._total_bytes = sum(size for size, _ in self._index.values())
+            first_pass = not self._bootstrapped
+            self._bootstrapped = True
+
+        if first_pass:
+            for directory in self.legacy_dirs:
+                self._sweep_legacy(directory)
+            print(f"Audio storage indexed {len(found)} clips ({self._total_bytes} bytes)")
+
+    def _sweep_legacy(self, directory):
+        now = time.time()
+        removed = 0
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            return
+        with entries:
+            for i, entry in enumerate(entries):
+                name = entry.name
+                try:
+                    if name.startswith('answer_') and name.endswith('.mp3'):
+                        ttl = self.max_age
+                    elif name.startswith('temp_audio_'):
+                        ttl = self.temp_ttl
+                    else:
+                        continue
+                    if now - entry.stat().st_mtime > ttl:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+                if i % AUDIO_REAPER_BATCH == AUDIO_REAPER_BATCH - 1:
+                    time.sleep(0)
+        if removed:
+            print(f"Removed {removed} legacy audio files from {directory}")
+
+    def reap(self):
+        """Evict clips past max_age or beyond max_bytes, and orphaned temp files"""
+        cutoff = time.time() - self.max_age
+        evicted = 0
+        with self._lock:
+            # Each clip is looked at once; one another worker used since the scan moves to the back
+            for _ in range(len(self._index)):
+                key, (size, last_access) = next(iter(self._index.items()))
+                if self._total_bytes <= self.max_bytes and last_access >= cutoff:
+                    break
+                entry = self._stat_clip(key)
+                if entry is None:
+                    continue
+                if entry[1] > last_access:
+                    self._index.move_to_end(key)
+                    continue
+                self._remove(key)
+                evicted += 1
+
+        temp_cutoff = time.time() - self.temp_ttl
+        with os.scandir(self.temp_directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < temp_cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+        if evicted:
+            print(f"Audio reaper evicted {evicted} clips")
+        return evicted
@@ -0,0 +1,154 @@
+"""Incremental PCM handling for streamed recordings: format parsing and voice-activity segmentation"""
+import os
+import struct
+from array import array
+from collections import deque
+
+from audio_decode import audioop, AudioDecodeError, TARGET_SAMPLE_RATE, TARGET_SAMPLE_WIDTH
+
+# RMS level (16-bit samples) above which a frame counts as speech
+VAD_ENERGY_THRESHOLD = int(os.environ.get('VAD_ENERGY_THRESHOLD', '300'))
+VAD_FRAME_MS = 30
+# Trailing silence that closes a segment
+VAD_SILENCE_MS = int(os.environ.get('VAD_SILENCE_MS', '600'))
+# Segments are cut at this length even mid-speech, which bounds memory per stream
+VAD_MAX_SEGMENT_MS = int(os.environ.get('VAD_MAX_SEGMENT_MS', '15000'))
+# Blips shorter than this are dropped instead of being sent to the recognizer
+VAD_MIN_SPEECH_MS = 200
+# Silence kept in front of a segment so word onsets are not clipped
+VAD_PREROLL_MS = 210
+
+def frame_rms(frame):
+    """Root-mean-square level of a 16-bit mono PCM frame"""
+    if audioop is not None:
+        return audioop.rms(frame, TARGET_SAMPLE_WIDTH)
+    samples = array('h', frame)
+    if not samples:
+        return 0
+    return int((sum(s * s for s in samples) / len(samples)) ** 0.5)
+
+class PCMStreamConverter:
+    """Converts successive raw PCM chunks to 16 kHz mono 16-bit, keeping resampler state"""
+
+    def __init__(self, sample_rate=TARGET_SAMPLE_RATE, channels=1, sample_width=TARGET_SAMPLE_WIDTH):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self._frame_bytes = channels * sample_width
+        self._pending = b''
+        self._ratecv_state = None
+        needs_conversion = (sample_rate, channels, sample_width) != (TARGET_SAMPLE_RATE, 1, TARGET_SAMPLE_WIDTH)
+        if needs_conversion and audioop is None:
+            raise AudioDecodeError('audioop is required to convert streamed audio')
+        if channels not in (1, 2):
+            raise AudioDecodeError(f"unsupported channel count: {channels}")
+
+    def convert(self, chunk):
+        data = self._pending + chunk
+        usable = len(data) - len(data) % self._frame_bytes
+        data, self._pending = data[:usable], data[usable:]
+        if not data:
+            return b''
+        if self.sample_width == 1:
+            data = audioop.bias(data, 1, -128)
+        if self.sample_width != TARGET_SAMPLE_WIDTH:
+            data = audioop.lin2lin(data, self.sample_width, TARGET_SAMPLE_WIDTH)
+        if self.channels == 2:
+            data = audioop.tomono(data, TARGET_SAMPLE_WIDTH, 0.5, 0.5)
+        if self.sample_rate != TARGET_SAMPLE_RATE:
+            data, self._ratecv_state = audioop.ratecv(
+                data, TARGET_SAMPLE_WIDTH, 1, self.sample_rate, TARGET_SAMPLE_RATE, self._ratecv_state)
+        return data
+
+def read_wav_header(read):
+    """Consume a WAV header from read(n) and return (sample_rate, channels, sample_width)"""
+    def read_exact(n):
+        data = b''
+        while len(data) < n:
+            chunk = read(n - len(data))
+            if not chunk:
+                raise AudioDecodeError('stream ended inside the WAV header')
+            data += chunk
+        return data
+
+    riff = read_exact(12)
+    if riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        raise AudioDecodeError('not a WAV stream')
+    fmt = None
+    while True:
+        chunk_id, chunk_size = struct.unpack('<4sI', read_exact(8))
+        if chunk_id == b'data':
+            if fmt is None:
+                raise AudioDecodeError('WAV data before fmt chunk')
+            return fmt
+        body = read_exact(chunk_size + (chunk_size & 1))
+        if chunk_id == b'fmt ':
+            audio_format, channels, sample_rate = struct.unpack('<HHI', body[:8])
+            bits_per_sample = struct.unpack('<H', body[14:16])[0]
+            if audio_format != 1:
+                raise AudioDecodeError('only PCM WAV can be streamed')
+            fmt = (sample_rate, channels, bits_per_sample // 8)
+
+class SpeechSegmenter:
+    """Energy-based voice-activity detector that cuts a PCM stream into utterances"""
+
+    def __init__(self, threshold=VAD_ENERGY_THRESHOLD, silence_ms=VAD_SILENCE_MS,
+                 max_segment_ms=VAD_MAX_SEGMENT_MS, min_speech_ms=VAD_MIN_SPEECH_MS):
+        self.threshold = threshold
+        self.frame_bytes = TARGET_SAMPLE_RATE * TARGET_SAMPLE_WIDTH * VAD_FRAME_MS // 1000
+        self.silence_frames = max(1, silence_ms // VAD_FRAME_MS)
+        self.max_segment_frames = max(1, max_segment_ms // VAD_FRAME_MS)
+        self.min_speech_frames = max(1, min_speech_ms // VAD_FRAME_MS)
+        self._pending = b''
+        self._preroll = deque(maxlen=max(1, VAD_PREROLL_MS // VAD_FRAME_MS))
+        self._segment = None
+        self._speech_frames = 0
+        self._silent_run = 0
+
+    def feed(self, pcm):
+        """Add 16 kHz mono PCM; return the list of segments completed by it"""
+        data = self._pending + pcm
+        completed = []
+        offset = 0
+        while len(data) - offset >= self.frame_bytes:
+            frame = data[offset:offset + self.frame_bytes]
+            offset += self.frame_bytes
+            segment = self._process_frame(frame)
+            if segment:
+                completed.append(segment)
+        self._pending = data[offset:]
+        return completed
+
+    def flush(self):
+        """End of stream: return the segment in progress, if it holds enough speech"""
+        segment = self._close_segment()
+        self._pending = b''
+        return segment
+
+    def _process_frame(self, frame):
+        is_speech = frame_rms(frame) >= self.threshold
+        if self._segment is None:
+            if not is_speech:
+                self._preroll.append(frame)
+                return None
+            self._segment = list(self._preroll)
+            self._preroll.clear()
+            self._speech_frames = 0
+            self._silent_run = 0
+
+        self._segment.append(frame)
+        if is_speech:
+            self._speech_frames += 1
+            self._silent_run = 0
+        else:
+            self._silent_run += 1
+
+        if self._silent_run >= self.silence_frames or len(self._segment) >= self.max_segment_frames:
+            return self._close_segment()
+        return None
+
+    def _close_segment(self):
+        segment, self._segment = self._segment, None
+        if not segment or self._speech_frames < self.min_speech_frames:
+            return None
+        return b''.join(segment)
@@ -0,0 +1,267 @@
+"""Time-of-use tariff engine built from the electricity_rates table"""
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime
+
+from db import get_db
+
+MINUTES_PER_DAY = 24 * 60
+# Seconds between reloads of electricity_rates
+TARIFF_RELOAD_INTERVAL = float(os.environ.get('TARIFF_RELOAD_INTERVAL', '300'))
+# Readings fetched and priced per round trip when recomputing costs
+TARIFF_BATCH_SIZE = int(os.environ.get('TARIFF_BATCH_SIZE', '10000'))
+
+UPDATE_READING_COST_SQL = 'UPDATE appliance_usage SET estimated_cost = ?, peak_kwh = ? WHERE id = ?'
+
+# Re-sum a user-day's cost from its priced readings. Only days whose kwh_used is the
+# readings' total (as written by ingestion) are touched: a day recorded some other
+# way would otherwise end up pricing just the part of its usage that has readings.
+UPDATE_DAILY_COST_SQL = '''
+    UPDATE Electricity_Usage SET (estimated_cost, is_peak_time) = (
+        SELECT ROUND(SUM(a.estimated_cost), 2), COALESCE(SUM(a.peak_kwh) * 2 > SUM(a.kwh_consumed), 0)
+        FROM appliance_usage a
+        WHERE a.meter_id IN (SELECT meter_id FROM smart_meters WHERE user_id = :user_id)
+          AND a.start_time >= :day AND a.start_time < date(:day, '+1 day')
+    )
+    WHERE user_id = :user_id AND date = :day
+      AND ABS(kwh_used - (
+        SELECT ROUND(SUM(a.kwh_consumed), 3)
+        FROM appliance_usage a
+        WHERE a.meter_id IN (SELECT meter_id FROM smart_meters WHERE user_id = :user_id)
+          AND a.start_time >= :day AND a.start_time < date(:day, '+1 day')
+      )) < 0.0005
+'''
+
+def parse_clock(value):
+    """Minutes after midnight for an 'HH:MM[:SS]' string"""
+    parts = [int(part) for part in value.split(':')]
+    return (parts[0] * 60 + parts[1]) % MINUTES_PER_DAY
+
+def format_clock(minute):
+    """'10 PM' style label for minutes after midnight"""
+    hour, minute = divmod(minute % MINUTES_PER_DAY, 60)
+    suffix = 'AM' if hour < 12 else 'PM'
+    hour = hour % 12 or 12
+    return f"{hour} {suffix}" if minute == 0 else f"{hour}:{minute:02d} {suffix}"
+
+class RateSchedule:
+    """One day's tariff as per-minute rates with prefix sums for O(1) interval pricing"""
+
+    def __init__(self, effective_date, rows):
+        # rows: (rate_type, rate_per_kwh, start_time, end_time), later rows take precedence
+        self.effective_date = effective_date
+        flat = [rate for rate_type, rate, start, end in rows if start is None or end is None]
+        windows = [row for row in rows if row[2] is not None and row[3] is not None]
+        # The flat rate is what a single-rate tariff would charge, used as the savings baseline
+        self.flat_rate = flat[-1] if flat else None
+
+        default_rate = self.flat_rate
+        if default_rate is None:
+            default_rate = sum(row[1] for row in windows) / len(windows) if windows else 0.0
+        self.rates = [default_rate] * MINUTES_PER_DAY
+        self.labels = ['standard'] * MINUTES_PER_DAY
+        for rate_type, rate, start, end in windows:
+            start, end = parse_clock(start), parse_clock(end)
+            minute = start
+            while True:
+                self.rates[minute] = rate
+                self.labels[minute] = rate_type
+                minute = (minute + 1) % MINUTES_PER_DAY
+                if minute == end:
+                    break
+
+        low, high = min(self.rates), max(self.rates)
+        self.peak_rate = high if high > low else None
+        # cumulative[i] = rate-minutes (and peak minutes) before minute i
+        self.cumulative = [0.0] * (MINUTES_PER_DAY + 1)
+        self.peak_cumulative = [0] * (MINUTES_PER_DAY + 1)
+        for minute, rate in enumerate(self.rates):
+            self.cumulative[minute + 1] = self.cumulative[minute] + rate
+            self.peak_cumulative[minute + 1] = self.peak_cumulative[minute] + (rate == self.peak_rate)
+        if self.flat_rate is None:
+            self.flat_rate = self.cumulative[-1] / MINUTES_PER_DAY
+        self._cheapest = False
+
+    def _integral(self, prefix, per_minute, offset):
+        """Prefix sum up to a fractional minute offset that may run past midnight"""
+        days, minute = divmod(offset, MINUTES_PER_DAY)
+        whole = int(minute)
+        return days * prefix[-1] + prefix[whole] + (minute - whole) * per_minute(whole)
+
+    def price(self, start_minute, duration):
+        """(average rate, share in peak) for consumption spread evenly over an interval"""
+        start_minute %= MINUTES_PER_DAY
+        if duration <= 0:
+            minute = int(start_minute)
+            return self.rates[minute], 1.0 if self.rates[minute] == self.peak_rate else 0.0
+        end_minute = start_minute + duration
+        rate_minutes = (self._integral(self.cumulative, self.rates.__getitem__, end_minute)
+                        - self._integral(self.cumulative, self.rates.__getitem__, start_minute))
+        is_peak = lambda minute: 1 if self.rates[minute] == self.peak_rate else 0
+        peak_minutes = (self._integral(self.peak_cumulative, is_peak, end_minute)
+                        - self._integral(self.peak_cumulative, is_peak, start_minute))
+        return rate_minutes / duration, peak_minutes / duration
+
+    def cheapest_window(self):
+        """(start_minute, end_minute, rate_type, rate) of the longest run at the lowest rate"""
+        # Schedules are immutable (a reload builds new ones), so the answer is computed once
+        if self._cheapest is False:
+            self._cheapest = self._find_cheapest_window()
+        return self._cheapest
+
+    def _find_cheapest_window(self):
+        low = min(self.rates)
+        if all(rate == low for rate in self.rates):
+            return None
+        # Walk from a non-cheap minute so a run wrapping past midnight stays in one piece
+        origin = next(minute for minute, rate in enumerate(self.rates) if rate != low)
+        best = None
+        run_start = None
+        for step in range(1, MINUTES_PER_DAY + 1):
+            minute = (origin + step) % MINUTES_PER_DAY
+            if self.rates[minute] == low and run_start is None:
+                run_start = step
+            elif self.rates[minute] != low and run_start is not None:
+                if best is None or step - run_start > best[1] - best[0]:
+                    best = (run_start, step)
+                run_start = None
+        start = (origin + best[0]) % MINUTES_PER_DAY
+        return start, (origin + best[1]) % MINUTES_PER_DAY, self.labels[start], low
+
+class TariffEngine:
+    """Rate schedules sorted by effective date, reloaded periodically from electricity_rates"""
+
+    def __init__(self, reload_interval=TARIFF_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        # (effective dates, schedules) swapped as one tuple
+        self._schedules = ([], [])
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Rebuild every schedule from the active rows of electricity_rates"""
+        with get_db() as conn:
+            try:
+                rows = conn.execute('''
+                    SELECT effective_date, rate_type, rate_per_kwh, start_time, end_time
+                    FROM electricity_rates WHERE is_active = 1 ORDER BY effective_date, id
+                ''').fetchall()
+            except sqlite3.OperationalError:
+                # Databases created before rates could be deactivated
+                rows = conn.execute('''
+                    SELECT effective_date, rate_type, rate_per_kwh, start_time, end_time
+                    FROM electricity_rates ORDER BY effective_date, id
+                ''').fetchall()
+
+        by_date = defaultdict(list)
+        for effective_date, rate_type, rate, start, end in rows:
+            by_date[str(effective_date)[:10]].append((rate_type, rate, start, end))
+        dates = sorted(by_date)
+        self._schedules = (dates, [RateSchedule(day, by_date[day]) for day in dates])
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.reload_interval:
+            return
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_interval:
+                try:
+                    self.load()
+                except sqlite3.Error as e:
+                    print(f"Error loading electricity rates: {e}")
+                    self._loaded_at = time.monotonic()
+
+    def schedule_for(self, day):
+        """The RateSchedule in effect on a YYYY-MM-DD date, or None before the first tariff"""
+        self._ensure_loaded()
+        dates, schedules = self._schedules
+        index = bisect_right(dates, day) - 1
+        return schedules[index] if index >= 0 else None
+
+    def greenest_window(self, day):
+        """(start label, end label, rate_type, rate) of the day's cheapest period, or None"""
+        schedule = self.schedule_for(day)
+        window = schedule.cheapest_window() if schedule else None
+        if window is None:
+            return None
+        start, end, rate_type, rate = window
+        return format_clock(start), format_clock(end), rate_type, rate
+
+    def flat_cost(self, kwh, day):
+        """What kwh would cost on the day's single-rate (standard) tariff"""
+        schedule = self.schedule_for(day)
+        if schedule is None or kwh is None:
+            return None
+        return kwh * schedule.flat_rate
+
+    def price_reading(self, start_time, end_time, kwh):
+        """(cost, peak_kwh) of one reading, or (None, None) before the first tariff
+
+        Consumption is spread evenly between start and end, so the price is
+        computed in constant time from the schedule's prefix sums however
+        long the reading runs.
+        """
+        schedule = self.schedule_for(start_time[:10])
+        if schedule is None:
+            return None, None
+        start = datetime.fromisoformat(start_time)
+        duration = 0.0
+        if end_time:
+            duration = max((datetime.fromisoformat(end_time) - start).total_seconds() / 60, 0.0)
+        rate, peak_share = schedule.price(start.hour * 60 + start.minute + start.second / 60, duration)
+        return round(kwh * rate, 6), round(kwh * peak_share, 6)
+
+    def price_rows(self, rows):
+        """Append (cost, peak_kwh) to (meter_id, appliance_name, start_time, end_time, kwh) rows"""
+        return [row + self.price_reading(row[2], row[3], row[4]) for row in rows]
+
+    def recompute(self, start_date, end_date, community_id=None):
+        """Reprice every reading between two dates (inclusive), e.g. after a tariff change
+
+        Readings are streamed meter by meter through the (meter_id, start_time)
+        index and repriced in batches, then each affected day's cost is summed
+        again. Every batch commits on its own, like ingestion, so a long
+        recompute never holds the write lock for more than one batch. Returns
+        the number of user-days updated.
+        """
+        self.load()
+        sql = '''
+            SELECT a.id, m.user_id, a.start_time, a.end_time, a.kwh_consumed
+            FROM smart_meters m
+            CROSS JOIN appliance_usage a ON a.meter_id = m.meter_id
+            WHERE m.user_id IS NOT NULL
+              AND a.start_time >= ? AND a.start_time < date(?, '+1 day')
+        '''
+        params = [start_date, end_date]
+        if community_id:
+            sql += ' AND m.user_id IN (SELECT user_id FROM users WHERE community_id = ?)'
+            params.append(community_id)
+
+        user_days = set()
+        updated = 0
+        with get_db() as conn:
+            write_cursor = conn.cursor()
+            read_cursor = conn.execute(sql, params)
+            while True:
+                batch = read_cursor.fetchmany(TARIFF_BATCH_SIZE)
+                if not batch:
+                    break
+                updates = []
+                for reading_id, user_id, start_time, end_time, kwh in batch:
+                    updates.append(self.price_reading(start_time, end_time, kwh) + (reading_id,))
+                    user_days.add((user_id, start_time[:10]))
+                write_cursor.executemany(UPDATE_READING_COST_SQL, updates)
+                conn.commit()
+
+            # A day's readings may span several batches, so days are re-summed once all are priced
+            user_days = sorted(user_days)
+            for start in range(0, len(user_days), TARIFF_BATCH_SIZE):
+                write_cursor.executemany(UPDATE_DAILY_COST_SQL, [
+                    {'user_id': user_id, 'day': day} for user_id, day in user_days[start:start + TARIFF_BATCH_SIZE]])
+                updated += max(write_cursor.rowcount, 0)
+                conn.commit()
+        return updated
@@ -0,0 +1,69 @@
+"""Response templates parsed once and rendered through a bounded cache"""
+import os
+from string import Formatter
+
+from cache import TTLCache
+
+# Rendered answers kept per (template, bound values)
+RENDER_CACHE_MAX_ENTRIES = int(os.environ.get('RENDER_CACHE_MAX_ENTRIES', '4096'))
+
+# Renders never go stale (a changed template is a new CompiledTemplate), so entries only age out by LRU
+render_cache = TTLCache(float('inf'), RENDER_CACHE_MAX_ENTRIES)
+
+_formatter = Formatter()
+
+class CompiledTemplate:
+    """A response_template split into literal text and fields, with str.format semantics
+
+    Templates without fields render to one memoized string. Others are cached
+    by the values bound to their fields, so repeated answers (including the
+    sample-data fallbacks) are built once and come back as the same string
+    object, which keeps downstream lookups keyed on the text cheap.
+    """
+
+    def __init__(self, text, cache=render_cache, verbatim=False):
+        self.text = text
+        self.cache = cache
+        self.parts = []
+        self.simple = True
+        # verbatim=True takes the text as-is, for templates str.format can't parse
+        for literal, field_name, spec, conversion in ([(text, None, None, None)] if verbatim else _formatter.parse(text)):
+            if field_name is not None:
+                # Positional, attribute, index and nested-spec fields keep plain str.format
+                if not field_name.isidentifier() or (spec and '{' in spec):
+                    self.simple = False
+                self.parts.append((literal, field_name, spec, conversion))
+            elif literal:
+                self.parts.append((literal, None, None, None))
+        self.fields = tuple(dict.fromkeys(part[1] for part in self.parts if part[1] is not None))
+        # Fully static answers are rendered now, once
+        self.static = self.simple and not self.fields
+        self.answer = self._render({}) if self.static else None
+
+    def format(self, **values):
+        """Render like str.format(**values), from the cache when the same values were seen"""
+        if self.static:
+            return self.answer
+        try:
+            # Typed, so equal values that format differently (15, 15.0, True) get separate entries
+            key = (self, tuple((type(values[field]), values[field]) for field in self.fields))
+            hash(key)
+        except (KeyError, TypeError):
+            return self._render(values)  # Missing (raises as str.format would) or unhashable values
+        return self.cache.get_or_load(key, lambda: self._render(values))
+
+    def _render(self, values):
+        if not self.simple:
+            return self.text.format(**values)
+        pieces = []
+        for literal, field_name, spec, conversion in self.parts:
+            pieces.append(literal)
+            if field_name is not None:
+                value = values[field_name]
+                if conversion:
+                    value = _formatter.convert_field(value, conversion)
+                pieces.append(format(value, spec))
+        return ''.join(pieces)
+
+    def __repr__(self):
+        return f"CompiledTemplate({self.text!r})"
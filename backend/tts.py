@@ -0,0 +1,248 @@
+"""Text-to-speech backends and the background synthesis worker pool"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from storage import AudioStorage
+from metrics import span
+
+# Which backend synthesizes answers: 'gtts' (Google, needs network) or 'stub' (offline, silent audio)
+TTS_BACKEND = os.environ.get('TTS_BACKEND', 'gtts')
+TTS_WORKERS = int(os.environ.get('TTS_WORKERS', '4'))
+TTS_LANG = os.environ.get('TTS_LANG', 'en')
+# Finished jobs are forgotten after this many seconds (the audio file itself stays in storage)
+TTS_JOB_TTL = float(os.environ.get('TTS_JOB_TTL', '600'))
+# Answer texts whose cache keys are remembered instead of rehashed
+TTS_KEY_CACHE_SIZE = int(os.environ.get('TTS_KEY_CACHE_SIZE', '4096'))
+
+class GTTSBackend:
+    """Google Translate TTS via gTTS"""
+    name = 'gtts'
+
+    def synthesize(self, text, path, lang=TTS_LANG, slow=False):
+        from gtts import gTTS
+        tts = gTTS(text=text, lang=lang, slow=slow)
+        # Write each decoded chunk as it arrives so the file can be streamed while it grows
+        with open(path, 'wb') as f:
+            for chunk in tts.stream():
+                f.write(chunk)
+                f.flush()
+
+class StubTTSBackend:
+    """Offline backend that writes a short silent MP3, for tests and local development"""
+    name = 'stub'
+    # One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz)
+    SILENT_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+
+    def __init__(self, frames=10, delay=0.0):
+        self.frames = frames
+        self.delay = delay
+
+    def synthesize(self, text, path, lang=TTS_LANG, slow=False):
+        if self.delay:
+            time.sleep(self.delay)
+        with open(path, 'wb') as f:
+            f.write(self.SILENT_FRAME * self.frames)
+
+TTS_BACKENDS = {
+    'gtts': GTTSBackend,
+    'stub': StubTTSBackend,
+}
+
+def register_backend(name, backend_class):
+    """Make a custom TTS backend selectable through TTS_BACKEND"""
+    TTS_BACKENDS[name] = backend_class
+
+def create_backend(name=TTS_BACKEND):
+    try:
+        return TTS_BACKENDS[name]()
+    except KeyError:
+        print(f"Unknown TTS backend '{name}', falling back to gtts")
+        return GTTSBackend()
+
+# Rendered answers come back from the template cache as the same string object,
+# so a repeat lookup here compares by identity and skips the SHA-256
+@lru_cache(maxsize=TTS_KEY_CACHE_SIZE)
+def tts_cache_key(text, lang=TTS_LANG, slow=False, backend=TTS_BACKEND):
+    """Content address for a synthesized clip: hash of the text and voice settings"""
+    digest = hashlib.sha256(f"{backend}\0{lang}\0{int(slow)}\0{text}".encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+def temp_path_for(path):
+    """A per-writer partial file next to path, published with os.replace"""
+    return f"{path}.{os.getpid()}-{uuid.uuid4().hex[:8]}.part"
+
+class TTSJob:
+    """One queued synthesis request"""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+
+    def __init__(self, job_id, text, path, lang=TTS_LANG):
+        self.job_id = job_id
+        self.text = text
+        self.path = path
+        self.filename = os.path.basename(path)
+        # Private to this job: other workers may be synthesizing the same clip at the same time
+        self.temp_path = temp_path_for(path)
+        self.lang = lang
+        self.status = self.PENDING
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes; returns True if it is ready"""
+        self._done.wait(timeout)
+        return self.status == self.READY
+
+    async def wait_async(self, timeout=None):
+        """wait() for event loops: resumes on completion without parking a thread"""
+        if not self.done:
+            loop = asyncio.get_running_loop()
+            finished = loop.create_future()
+            
+            def wake(_job):
+                loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(None))
+            self.add_done_callback(wake)
+            try:
+                await asyncio.wait_for(finished, timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.status == self.READY
+
+    def add_done_callback(self, callback):
+        """Call callback(job) once the job finishes (right away if it already has)"""
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def finish(self):
+        """Mark the job done and run its callbacks"""
+        with self._callbacks_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'filename': self.filename,
+            'error': self.error,
+        }
+
+class TTSService:
+    """Runs synthesis on a background thread pool, backed by the content-addressed cache"""
+
+    def __init__(self, backend=None, workers=TTS_WORKERS, job_ttl=TTS_JOB_TTL, cache=None):
+        self.backend = backend or create_backend()
+        self.workers = workers
+        self.job_ttl = job_ttl
+        # Content-addressed store: identical answers share one clip
+        self.cache = cache or AudioStorage()
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily so worker threads are started in the process that serves requests
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='tts')
+        return self._executor
+
+    def cache_key(self, text, lang=TTS_LANG):
+        return tts_cache_key(text, lang, backend=self.backend.name)
+
+    def submit(self, text, lang=TTS_LANG):
+        """Return a job for text: already ready on a cache hit, shared if already in flight"""
+        key = self.cache_key(text, lang)
+        if self.cache.get(key):
+            return self._ready_job(key, text, lang)
+        
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(key)
+            if job and job.status != TTSJob.FAILED and (not job.done or key in self.cache):
+                return job
+            job = TTSJob(key, text, self.cache.path_for(key), lang)
+            self._jobs[key] = job
+        self._get_executor().submit(self._run, job)
+        return job
+
+    def prewarm(self, texts, lang=TTS_LANG):
+        """Queue synthesis for answers that are known to be requested often"""
+        jobs = [self.submit(text, lang) for text in set(texts) if text]
+        print(f"Pre-warming TTS cache with {len(jobs)} answers")
+        return jobs
+
+    def synthesize(self, text, path, lang=TTS_LANG, tmp_path=None):
+        """Synthesize synchronously into path; returns True on success"""
+        self.cache.ensure_directories()
+        tmp_path = tmp_path or temp_path_for(path)
+        try:
+            self.backend.synthesize(text, tmp_path, lang=lang)
+            # Publish atomically so readers never see a half-written file
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            print(f"Error in text-to-speech: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+    def get(self, job_id):
+        """Look up a job by id (its cache key), including clips only known to the cache"""
+        job = self._jobs.get(job_id)
+        if job is None and job_id in self.cache:
+            job = self._ready_job(job_id, None)
+        return job
+
+    def _ready_job(self, key, text, lang=TTS_LANG):
+        job = TTSJob(key, text, self.cache.path_for(key), lang)
+        job.status = TTSJob.READY
+        job.finished_at = time.time()
+        job.finish()
+        return job
+
+    def _run(self, job):
+        job.status = TTSJob.PROCESSING
+        with span('tts_synthesize'):
+            synthesized = self.synthesize(job.text, job.path, job.lang, job.temp_path)
+        if synthesized:
+            self.cache.add(job.job_id)
+            job.status = TTSJob.READY
+        else:
+            job.status = TTSJob.FAILED
+            job.error = 'Text-to-speech failed'
+        job.finished_at = time.time()
+        job.finish()
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)